@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+
+#Copyright (c) 2020 André Santos
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in
+#all copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#THE SOFTWARE.
+
+
+###############################################################################
+# Notes
+###############################################################################
+
+# Solvers for the (rectangular) linear assignment problem.
+# Every solver takes a cost matrix, with one row per predicted entity and one
+# column per ground truth entity, and returns a pair of index arrays
+# `(rows, cols)` such that `rows[k]` is assigned to `cols[k]`.
+
+
+###############################################################################
+# Imports
+###############################################################################
+
+from builtins import range, zip
+import time
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+###############################################################################
+# Dense Assignment
+###############################################################################
+
+def dense_assignment(W):
+    if W.shape[0] == 0 or W.shape[1] == 0:
+        return _no_assignment()
+    return linear_sum_assignment(W)
+
+
+###############################################################################
+# Threshold Assignment
+###############################################################################
+
+# Pairs with a cost at or above the threshold `t` are never matched.
+# Thus, the problem splits into independent blocks, the connected components
+# of the bipartite graph of pairs below the threshold, and each block can be
+# solved on its own. Within a block, costs are capped at `t`, so that any
+# pair at or above the threshold is as good as leaving both sides unmatched;
+# this is what makes the decomposition exact.
+# Only pairs below the threshold are returned.
+# Small problems, and problems with every pair below the threshold, are
+# solved as a single block, since finding the components would take longer
+# than the solve itself, or would find just one.
+# Blocks are solved with `solve(B, t, rows, cols)`, where `B` is the block
+# cost matrix and `rows`/`cols` its indices in `W`; it must return the local
+# indices of the pairs below the threshold (see `capped_assignment`).
+
+DECOMPOSE_MIN_SIZE = 256
+
+def threshold_assignment(W, t, solve=None):
+    if solve is None:
+        solve = capped_assignment
+    n, m = W.shape
+    if n == 0 or m == 0:
+        return _no_assignment()
+    if n * m < DECOMPOSE_MIN_SIZE:
+        return solve(W, t, np.arange(n), np.arange(m))
+    below = W < t
+    edge_rows, edge_cols = np.nonzero(below)
+    if edge_rows.size == 0:
+        return _no_assignment()
+    if edge_rows.size == n * m:
+        return solve(W, t, np.arange(n), np.arange(m))
+    G = coo_matrix((np.ones(edge_rows.size, dtype=np.int8),
+                    (edge_rows, edge_cols + n)), shape=(n + m, n + m))
+    k, labels = connected_components(G, directed=False)
+    row_blocks = _group_by_label(labels[:n], k)
+    col_blocks = _group_by_label(labels[n:], k)
+    rows = []
+    cols = []
+    for r, c in zip(row_blocks, col_blocks):
+        if r.size == 0 or c.size == 0:
+            continue
+        if r.size == 1 and c.size == 1:
+            rows.append(r)
+            cols.append(c)
+            continue
+        i, j = solve(W[np.ix_(r, c)], t, r, c)
+        rows.append(r[i])
+        cols.append(c[j])
+    if not rows:
+        return _no_assignment()
+    return (np.concatenate(rows), np.concatenate(cols))
+
+def capped_assignment(W, t, rows=None, cols=None):
+    i, j = linear_sum_assignment(np.minimum(W, t))
+    keep = W[i, j] < t
+    return (i[keep], j[keep])
+
+
+###############################################################################
+# Sparse Assignment
+###############################################################################
+
+# Solves the same problem as `threshold_assignment`, but only for a sparse
+# set of candidate pairs `(I[k], J[k])` with costs `C[k]`, for an `n` by `m`
+# problem. Candidates at or above the threshold `t` are dropped.
+# Every entity gets a dummy partner that stands for "unmatched":
+#   rows = n predicted entities + m dummy rows (one per truth entity)
+#   cols = m truth entities + n dummy cols (one per predicted entity)
+# Leaving an entity unmatched costs `t/2`, so a pair costing `c` is chosen
+# over two unmatched entities exactly when `c < t`. For every candidate pair
+# (i, j) there is also a free edge from dummy row j to dummy col i, which
+# completes the perfect matching whenever i and j are matched together.
+
+def sparse_assignment(n, m, I, J, C, t):
+    try:
+        from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+    except ImportError:
+        raise ImportError("sparse_assignment requires SciPy >= 1.6.0: "
+                          "https://scipy.org/")
+    keep = C < t
+    I = I[keep]
+    J = J[keep]
+    C = C[keep]
+    if n == 0 or m == 0 or I.size == 0:
+        return _no_assignment()
+    if t == float("inf"):
+        # maximum cardinality first, as in a full dense assignment
+        unmatched = (C.max() + 1.0) * (min(n, m) + 1)
+    else:
+        unmatched = t / 2.0
+    lhs = np.arange(n)
+    rhs = np.arange(m)
+    rows = np.concatenate((I, lhs, n + rhs, n + J))
+    cols = np.concatenate((J, m + lhs, rhs, m + I))
+    weights = np.concatenate((
+        C.astype(np.float64),
+        np.full(n + m, unmatched, dtype=np.float64),
+        np.zeros(I.size, dtype=np.float64)))
+    # explicit zeros could be taken as missing edges; a constant offset
+    # does not change the optimum of a perfect matching
+    weights += 1.0
+    G = coo_matrix((weights, (rows, cols)), shape=(n + m, m + n)).tocsr()
+    _, matched_cols = min_weight_full_bipartite_matching(G)
+    matched_cols = matched_cols[:n]
+    real = matched_cols < m
+    return (lhs[real], matched_cols[real])
+
+
+###############################################################################
+# Approximate Assignment
+###############################################################################
+
+# Solves the problem of `sparse_assignment` approximately, for the same
+# candidate pairs, in the same terms: every unmatched entity costs `t/2`.
+# A greedy pass takes the candidate pairs in order of cost, whenever both
+# sides are free; it sorts the k candidate pairs, in O(k log k) time, and
+# always runs to the end. Then, a local search goes over the candidate
+# pairs (i, j) and rematches i with j, and their former partners with each
+# other (if they are a candidate pair, or leaves them unmatched), whenever
+# the total cost decreases, until no such exchange is left or `deadline`
+# (a `time.time()` value) passes. The best assignment so far is returned.
+# Returns (rows, cols, cost, lower, complete), where `cost` is the total
+# cost of the assignment and `lower` a lower bound of the optimal cost
+# (each entity pays half of its cheapest pair, or of `t`), so that
+# `cost - lower` bounds how far the assignment is from the optimum, and
+# `complete` is False if the deadline cut the search short.
+
+# candidate pairs between deadline checks
+APPROX_CHECK_INTERVAL = 1 << 14
+
+def approx_assignment(n, m, I, J, C, t, deadline=None):
+    keep = C < t
+    I = I[keep]
+    J = J[keep]
+    C = C[keep].astype(np.float64)
+    if n == 0 or m == 0 or I.size == 0:
+        rows, cols = _no_assignment()
+        return (rows, cols, (n + m) * t / 2.0, (n + m) * t / 2.0, True)
+    if t == float("inf"):
+        # maximum cardinality first, as in `sparse_assignment`
+        half = (C.max() + 1.0) * (min(n, m) + 1)
+    else:
+        half = t / 2.0
+    order = np.argsort(C, kind="mergesort")
+    I = I[order].tolist()
+    J = J[order].tolist()
+    C = C[order].tolist()
+    col_of = [-1] * n
+    row_of = [-1] * m
+    cost_of = [half] * n  # cost of the pair of each row
+    _greedy_pairs(I, J, C, col_of, row_of, cost_of)
+    complete = deadline is None or time.time() < deadline
+    if complete:
+        costs = {i * m + j: c for i, j, c in zip(I, J, C)}
+        complete = _exchange_pairs(I, J, C, costs, m, half, col_of,
+                                   row_of, cost_of, deadline)
+    rows = np.array([i for i in range(n) if col_of[i] >= 0], dtype=np.intp)
+    cols = np.array([col_of[i] for i in rows.tolist()], dtype=np.intp)
+    cost = (sum(cost_of[i] for i in rows.tolist())
+            + half * (n + m - 2 * rows.size))
+    lower = np.full(n + m, 2.0 * half)
+    np.minimum.at(lower, I, C)
+    np.minimum.at(lower, n + np.array(J, dtype=np.intp), C)
+    return (rows, cols, cost, min(cost, float(lower.sum()) / 2.0),
+            complete)
+
+def _greedy_pairs(I, J, C, col_of, row_of, cost_of):
+    left = min(len(col_of), len(row_of))
+    for k in range(len(I)):
+        i = I[k]
+        j = J[k]
+        if col_of[i] < 0 and row_of[j] < 0:
+            col_of[i] = j
+            row_of[j] = i
+            cost_of[i] = C[k]
+            left -= 1
+            if left == 0:
+                break
+
+def _exchange_pairs(I, J, C, costs, m, half, col_of, row_of, cost_of,
+                    deadline):
+    # Returns False if interrupted by the deadline.
+    improved = True
+    while improved:
+        improved = False
+        for k in range(len(I)):
+            if (deadline is not None and k % APPROX_CHECK_INTERVAL == 0
+                    and time.time() >= deadline):
+                return False
+            i = I[k]
+            j = J[k]
+            j0 = col_of[i]
+            if j0 == j:
+                continue
+            i1 = row_of[j]
+            old = (cost_of[i] if j0 >= 0 else half)
+            old += cost_of[i1] if i1 >= 0 else half
+            new = C[k]
+            rest = -1.0  # cost of pairing i1 with j0, if a candidate
+            if i1 >= 0 and j0 >= 0:
+                rest = costs.get(i1 * m + j0, -1.0)
+                new += rest if rest >= 0.0 else 2 * half
+            elif i1 >= 0 or j0 >= 0:
+                new += half
+            if new >= old - 1e-9:
+                continue
+            col_of[i] = j
+            row_of[j] = i
+            cost_of[i] = C[k]
+            if i1 >= 0:
+                col_of[i1] = -1
+            if j0 >= 0:
+                row_of[j0] = -1
+            if rest >= 0.0:
+                col_of[i1] = j0
+                row_of[j0] = i1
+                cost_of[i1] = rest
+            improved = True
+    return True
+
+
+###############################################################################
+# Helper Functions
+###############################################################################
+
+def _no_assignment():
+    return (np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp))
+
+def _group_by_label(labels, k):
+    # Returns a list with the (sorted) indices that have each label.
+    order = np.argsort(labels, kind="mergesort")
+    bounds = np.searchsorted(labels[order], np.arange(k + 1))
+    return [order[bounds[i]:bounds[i+1]] for i in range(k)]
@@ -0,0 +1,459 @@
+# -*- coding: utf-8 -*-
+
+#Copyright (c) 2020 André Santos
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in
+#all copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#THE SOFTWARE.
+
+
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function
+from builtins import object, range
+from collections import namedtuple
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+from timeit import default_timer as timer
+
+import numpy as np
+
+from .graph_diff import (
+    GraphDiffCalculator, DEFAULT_MAX_DIFFS, DIFF_MODES
+)
+from .graph_matching import (
+    node_matching, param_matching, link_matching, clear_entity_store,
+    cost_rosname_rostype_traceability, ApproxRecorder, GraphData,
+    MatchOptions, LINK_ATTRS
+)
+from .output_format import (
+    perf_report_html, write_html_diffs, write_jsonl, write_latex,
+    DUMP_SUFFIXES
+)
+
+
+###############################################################################
+# Synthetic Models
+###############################################################################
+
+# nodes: number of nodes in the ground truth
+# links: average number of links (of any kind) per node
+# params: average number of launch parameters per node
+# wildcards: probability of an extracted name being unresolved ("?")
+# perturbation: probability of an extracted entity being missing, or having
+#   a wrong name, type or location, in equal parts; spurious entities are
+#   added at a quarter of this rate
+# seed: the same spec always generates the same model and ground truth
+SyntheticSpec = namedtuple("SyntheticSpec",
+    ("nodes", "links", "params", "wildcards", "perturbation", "seed"))
+
+DEFAULT_SPEC = SyntheticSpec(100, 6, 2, 0.1, 0.2, 0)
+
+# (truth attribute, HAROS attribute, resource attribute, truth type key,
+#  truth value key)
+LINK_KINDS = (
+    ("publishers", "publishers", "topic", "msg_type", None),
+    ("subscribers", "subscribers", "topic", "msg_type", None),
+    ("clients", "clients", "service", "srv_type", None),
+    ("servers", "servers", "service", "srv_type", None),
+    ("setters", "writes", "parameter", "param_type", "value"),
+    ("getters", "reads", "parameter", "param_type", "default_value"),
+)
+
+
+def synthetic_config(spec=DEFAULT_SPEC):
+    # Returns a HAROS-like configuration and a raw ground truth for it.
+    return _Generator(spec).generate()
+
+
+class _Stub(object):
+    # stands in for HAROS model objects, which are only read by attribute
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class _Generator(object):
+    def __init__(self, spec):
+        self.spec = spec
+        self.rnd = random.Random(spec.seed)
+        n = max(1, spec.nodes)
+        self.packages = ["pkg{}".format(i) for i in range(max(1, n // 20))]
+        self.namespaces = ["/ns{}".format(i) for i in range(max(1, n // 10))]
+        # names are shared, so that the links of different nodes meet
+        self.names = max(1, int(n * spec.links) // 4)
+        self.spurious = 0
+        self.nodes = []
+        self.params = []
+        self.truth = {"nodes": {}, "parameters": {}}
+
+    def generate(self):
+        spec = self.spec
+        for i in range(spec.nodes):
+            self._node(i)
+        for i in range(int(spec.nodes * spec.params)):
+            self._param(i)
+        config = _Stub(name="synthetic-{}".format(spec.nodes),
+                       nodes=_Stub(enabled=self.nodes),
+                       parameters=_Stub(enabled=self.params))
+        return config, self.truth
+
+    def _node(self, i):
+        rnd = self.rnd
+        pkg = rnd.choice(self.packages)
+        rosname = "{}/node{}".format(rnd.choice(self.namespaces), i)
+        rostype = "{}/type{}".format(pkg, rnd.randrange(8))
+        launch = "launch/{}.launch".format(pkg)
+        loc = (pkg, launch, 2 * i + 2, 5)
+        conditions = self._conditions(pkg, launch, 2 * i + 1)
+        data = {"node_type": rostype, "traceability": _truth_location(loc),
+                "conditions": _truth_conditions(conditions),
+                "args": "", "remaps": {}}
+        links = {kind[1]: [] for kind in LINK_KINDS}
+        source = "src/node{}.cpp".format(i)
+        for _ in range(rnd.randint(0, int(2 * self.spec.links))):
+            kind = rnd.choice(LINK_KINDS)
+            link = self._link(kind, pkg, source, data.setdefault(kind[0], []))
+            if link is not None:
+                links[kind[1]].append(link)
+            if self._spurious():
+                links[kind[1]].append(self._spurious_link(kind, pkg, source))
+        self.truth["nodes"][rosname] = data
+        extracted = self._extract(rosname, rostype, loc)
+        if extracted is not None:
+            rosname, rostype, loc = extracted
+            self.nodes.append(_Stub(_location=_haros_location(loc),
+                location2=None, conditions=_haros_conditions(conditions),
+                id=rosname, type=rostype, argv="", remaps={}, **links))
+        if self._spurious():
+            self.nodes.append(_Stub(_location=_haros_location(
+                    (pkg, launch, 2 * i + 2, 40)),
+                location2=None, conditions=[],
+                id="/spurious/node{}".format(self.spurious),
+                type="spurious/type", argv="", remaps={},
+                **{kind[1]: [] for kind in LINK_KINDS}))
+
+    def _link(self, kind, pkg, source, truth_links):
+        rnd = self.rnd
+        attr, _, resource, type_key, value_key = kind
+        j = rnd.randrange(self.names)
+        rosname = "/{}{}".format(resource, j)
+        rostype = "{}_types/T{}".format(resource, j % 16)
+        line = rnd.randint(3, 500)
+        loc = (pkg, source, line, rnd.randint(1, 80))
+        conditions = self._conditions(pkg, source, line - 1)
+        data = {resource: rosname, type_key: rostype,
+                "traceability": _truth_location(loc),
+                "conditions": _truth_conditions(conditions)}
+        if resource == "topic":
+            data["queue_size"] = 10
+        if attr == "publishers":
+            data["latched"] = False
+        if value_key is not None:
+            data[value_key] = j
+        truth_links.append(data)
+        extracted = self._extract(rosname, rostype, loc)
+        if extracted is None:
+            return None
+        rosname, rostype, loc = extracted
+        return self._haros_link(kind, rosname, rostype, loc, conditions, j)
+
+    def _spurious_link(self, kind, pkg, source):
+        loc = (pkg, source, self.rnd.randint(501, 600), 1)
+        return self._haros_link(kind, "/spurious{}".format(self.spurious),
+            "spurious/Type", loc, (), None)
+
+    def _haros_link(self, kind, rosname, rostype, loc, conditions, value):
+        link = _Stub(source_location=_haros_location(loc), location2=None,
+            conditions=_haros_conditions(conditions), type=rostype,
+            rosname=_Stub(full=rosname), queue_size=10, latched=False,
+            value=value)
+        setattr(link, kind[2], _Stub(id=rosname))
+        return link
+
+    def _param(self, i):
+        rnd = self.rnd
+        pkg = rnd.choice(self.packages)
+        rosname = "{}/param{}".format(rnd.choice(self.namespaces), i)
+        loc = (pkg, "launch/{}.launch".format(pkg), 1000 + i, 5)
+        if rnd.random() < 0.1:
+            # unfolded into one parameter per leaf
+            value = {"a": i, "b": {"c": "x"}}
+            leaves = ((rosname + "/a", "int", i),
+                      (rosname + "/b/c", "str", "x"))
+            rostype = "yaml"
+        else:
+            value = i
+            leaves = ((rosname, "int", i),)
+            rostype = "int"
+        self.truth["parameters"][rosname] = {"param_type": rostype,
+            "default_value": value, "traceability": _truth_location(loc),
+            "conditions": []}
+        for name, leaf_type, leaf_value in leaves:
+            extracted = self._extract(name, leaf_type, loc)
+            if extracted is not None:
+                self.params.append(self._haros_param(extracted, leaf_value))
+        if self._spurious():
+            self.params.append(self._haros_param(
+                ("/spurious{}".format(self.spurious), "str",
+                 (loc[0], loc[1], loc[2], 40)), "x"))
+
+    def _haros_param(self, extracted, value):
+        rosname, rostype, loc = extracted
+        return _Stub(launch=True, _location=_haros_location(loc),
+            location2=None, conditions=[], id=rosname, type=rostype,
+            value=value)
+
+    def _conditions(self, pkg, fname, line):
+        if self.rnd.random() < 0.2:
+            return ((pkg, fname, line, 1, "if"),)
+        return ()
+
+    def _extract(self, rosname, rostype, loc):
+        # Returns the extracted (rosname, rostype, loc), or None if missing.
+        rnd = self.rnd
+        p = self.spec.perturbation
+        r = rnd.random()
+        if r < p / 4:
+            return None
+        if r < p / 2:
+            rosname = rosname + "_x"
+        elif r < 3 * p / 4:
+            rostype = rostype + "_x"
+        elif r < p:
+            loc = (loc[0], loc[1], loc[2] + rnd.randint(1, 3), loc[3])
+        if rnd.random() < self.spec.wildcards:
+            rosname = rosname.rsplit("/", 1)[0] + "/?"
+        return rosname, rostype, loc
+
+    def _spurious(self):
+        if self.rnd.random() < self.spec.perturbation / 4:
+            self.spurious += 1
+            return True
+        return False
+
+
+def _haros_location(loc):
+    return _Stub(package=_Stub(name=loc[0]), file=_Stub(full_name=loc[1]),
+                 line=loc[2], column=loc[3])
+
+def _haros_conditions(conditions):
+    return [_Stub(location=_haros_location(c[:4]), statement=c[4])
+            for c in conditions]
+
+def _truth_location(loc):
+    return {"package": loc[0], "file": loc[1], "line": loc[2],
+            "column": loc[3]}
+
+def _truth_conditions(conditions):
+    if not conditions:
+        return []
+    path = []
+    for c in conditions:
+        guard = _truth_location(c[:4])
+        guard["statement"] = c[4]
+        path.append(guard)
+    return [path]
+
+
+###############################################################################
+# Benchmarks
+###############################################################################
+
+PHASES = ("nodes", "parameters", "links", "evaluators",
+          "html", "latex", "jsonl")
+
+# same cost function and threshold as `matching_by_name_type_loc`
+MATCH_COST = cost_rosname_rostype_traceability
+MATCH_THRESHOLD = 5*2*3
+
+
+def run_benchmark(sizes, spec=DEFAULT_SPEC, options=None, diffs="all",
+                  max_diffs=DEFAULT_MAX_DIFFS, compression=None, repeat=3,
+                  out_dir=None):
+    # Returns a JSON-serializable dict with the best (and every) time of
+    # each phase, for a synthetic model of each number of nodes in `sizes`.
+    # Report files are written to `out_dir`, or to a temporary directory.
+    options = options or MatchOptions()
+    tmp_dir = None
+    if out_dir is None:
+        out_dir = tmp_dir = tempfile.mkdtemp(prefix="ged-bench-")
+    elif not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    try:
+        runs = [benchmark_size(spec._replace(nodes=n), options, diffs,
+                               max_diffs, compression, repeat, out_dir)
+                for n in sizes]
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "options": {"solver": options.solver, "workers": options.workers,
+                    "pool": options.pool,
+                    "time_budget": options.time_budget, "diffs": diffs,
+                    "max_diffs": max_diffs, "compression": compression},
+        "repeat": repeat,
+        "runs": runs,
+    }
+
+def benchmark_size(spec, options, diffs, max_diffs, compression, repeat,
+                   out_dir):
+    config, truth = synthetic_config(spec)
+    samples = {phase: [] for phase in PHASES}
+    report = None
+    for _ in range(max(1, repeat)):
+        # each repetition converts and interns everything from scratch
+        clear_entity_store()
+        report, times = _timed_run(config, truth, options, diffs, max_diffs,
+            compression, out_dir)
+        for phase in PHASES:
+            samples[phase].append(times[phase])
+    return {
+        "spec": dict(spec._asdict()),
+        "entities": _entity_counts(report.matching),
+        "diffs": sum(sum(getattr(report.resource, attr).diff_counts.values())
+                     for attr in report.resource._fields),
+        "f1": report.aggregate.overall["*"].f1,
+        "ged": dict(report.ged._asdict()),
+        "approximate": {resource: dict(b._asdict())
+                        for resource, b in report.approximate.items()},
+        "times": {phase: min(samples[phase]) for phase in PHASES},
+        "samples": samples,
+    }
+
+def _timed_run(config, truth, options, diffs, max_diffs, compression,
+               out_dir):
+    times = {}
+    if options.solver == "approx":
+        options = options.replace(approx=ApproxRecorder(options.time_budget))
+    start_time = timer()
+    M_nodes = node_matching(config.nodes.enabled, truth["nodes"],
+        MATCH_COST, t=MATCH_THRESHOLD, options=options)
+    times["nodes"] = timer() - start_time
+    start_time = timer()
+    M_params = param_matching(config.parameters.enabled,
+        truth["parameters"], MATCH_COST, t=MATCH_THRESHOLD, options=options)
+    times["parameters"] = timer() - start_time
+    start_time = timer()
+    links = [link_matching(M_nodes, attr, MATCH_COST, t=MATCH_THRESHOLD,
+                           options=options)
+             for attr in LINK_ATTRS]
+    times["links"] = timer() - start_time
+    match_data = GraphData(M_nodes, M_params, *links)
+    match_time = times["nodes"] + times["parameters"] + times["links"]
+    approximate = None
+    if options.approx is not None:
+        approximate = options.approx.bounds
+    calc = GraphDiffCalculator(options=options, diffs=diffs,
+        max_diffs=max_diffs)
+    report = calc.evaluate(match_data, match_time=match_time,
+                           approximate=approximate)
+    times["evaluators"] = report.report_time
+    prefix = os.path.join(out_dir, "bench-{}".format(config.name))
+    start_time = timer()
+    files = write_html_diffs(prefix + "-diffs", report)
+    perf_report_html(report, match_time, 0, files, diff_mode=diffs)
+    times["html"] = timer() - start_time
+    start_time = timer()
+    write_latex(prefix + ".tex", report)
+    times["latex"] = timer() - start_time
+    start_time = timer()
+    write_jsonl(prefix + ".jsonl" + DUMP_SUFFIXES[compression], report,
+                compression=compression)
+    times["jsonl"] = timer() - start_time
+    return report, times
+
+def _entity_counts(match_data):
+    return {field: {"model": len(M.matches) + len(M.spurious),
+                    "truth": len(M.matches) + len(M.missing)}
+            for field, M in zip(match_data._fields, match_data)}
+
+
+def write_results(fname, results):
+    with open(fname, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+def print_results(results):
+    print("{:>8}".format("nodes") + "".join("{:>12}".format(phase)
+                                            for phase in PHASES))
+    for run in results["runs"]:
+        print("{:>8}".format(run["spec"]["nodes"]) + "".join(
+            "{:>10.1f}ms".format(1000 * run["times"][phase])
+            for phase in PHASES))
+
+
+###############################################################################
+# Entry Point
+###############################################################################
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(prog="haros_plugin_model_ged.benchmark",
+        description="Time the matching and reporting phases on synthetic "
+                    "models of increasing size.")
+    parser.add_argument("sizes", nargs="*", type=int,
+        default=[10, 100, 1000], help="numbers of nodes")
+    parser.add_argument("--links", type=float, default=DEFAULT_SPEC.links,
+        help="average links per node")
+    parser.add_argument("--params", type=float, default=DEFAULT_SPEC.params,
+        help="average launch parameters per node")
+    parser.add_argument("--wildcards", type=float,
+        default=DEFAULT_SPEC.wildcards, help="rate of unresolved names")
+    parser.add_argument("--perturbation", type=float,
+        default=DEFAULT_SPEC.perturbation,
+        help="rate of missing, spurious or wrong entities")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SPEC.seed)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--solver", choices=MatchOptions.SOLVERS,
+        default="dense")
+    parser.add_argument("--time-budget", type=float,
+        help="seconds for the approx solver to improve its solutions")
+    parser.add_argument("--diffs", choices=DIFF_MODES, default="all")
+    parser.add_argument("--max-diffs", type=int, default=DEFAULT_MAX_DIFFS)
+    parser.add_argument("--compression", choices=("gzip", "zstd"))
+    parser.add_argument("--out-dir",
+        help="keep the report files in this directory")
+    parser.add_argument("-o", "--output", default="perf-benchmark.json",
+        help="JSON file for the results")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    spec = SyntheticSpec(0, args.links, args.params, args.wildcards,
+                         args.perturbation, args.seed)
+    results = run_benchmark(args.sizes, spec=spec,
+        options=MatchOptions(solver=args.solver,
+                             time_budget=args.time_budget),
+        diffs=args.diffs,
+        max_diffs=args.max_diffs, compression=args.compression,
+        repeat=args.repeat, out_dir=args.out_dir)
+    write_results(args.output, results)
+    print_results(results)
+    return 0
+
+
+if __name__ == "__main__":
+    main()
@@ -30,11 +30,16 @@ from past.utils import old_div
 from builtins import object
 from builtins import range
 from collections import namedtuple
+import random
 from timeit import default_timer as timer
 
+import numpy as np
+
 from .graph_matching import (
-    matching_by_name_type_loc, matching_by_loc_name_type, rosname_match
+    matching_by_name_type_loc, matching_by_loc_name_type, rosname_match,
+    ApproxRecorder, ConditionTree, DebugLog, DEFAULT_OPTIONS
 )
+from .tracing import span
 
 ###############################################################################
 # Graph Difference Calculation
@@ -46,7 +51,9 @@ Diff = namedtuple("Diff",
 MetricsTuple = namedtuple("MetricsTuple",
     ("cor", "inc", "par", "mis", "spu", "pre", "rec", "f1"))
 
-Report = namedtuple("Report", ("metrics", "diffs"))
+# `diff_counts` holds the exact number of diffs per category (attribute,
+# "missing" or "spurious"), even if only some of them are kept in `diffs`
+Report = namedtuple("Report", ("metrics", "diffs", "diff_counts"))
 
 ResourceReport = namedtuple("ResourceReport",
     ("node", "parameter", "publisher", "subscriber",
@@ -56,105 +63,293 @@ ResourceReport = namedtuple("ResourceReport",
 AggregateReport = namedtuple("AggregateReport",
     ("overall", "launch", "source", "topics", "services", "params"))
 
+# `matching` is the GraphData the report was computed from
+# `table` is the MetricsTable of all counts
+# `approximate` maps resource types (GraphData fields) matched with the
+#   "approx" solver to their ApproxBound; it is empty if matching was exact
+# `ged` is the GraphEditDistance of the matching
 PerformanceReport = namedtuple("PerformanceReport",
-    ("aggregate", "resource", "match_time", "report_time"))
+    ("aggregate", "resource", "match_time", "report_time", "matching",
+     "table", "approximate", "ged"))
+
+
+# all: keep every diff
+# sample: keep up to `max_diffs` random diffs per category and resource type
+# none: metrics only, no diffs at all
+DIFF_MODES = ("all", "sample", "none")
+
+DEFAULT_MAX_DIFFS = 100
 
 
 class GraphDiffCalculator(object):
-    def __init__(self):
-        self.node_perf = NodePerformanceEvaluator()
-        self.param_perf = ParamPerformanceEvaluator()
-        self.pub_perf = PubPerformanceEvaluator()
-        self.sub_perf = SubPerformanceEvaluator()
-        self.cli_perf = ClientPerformanceEvaluator()
-        self.srv_perf = ServerPerformanceEvaluator()
-        self.setter_perf = SetterPerformanceEvaluator()
-        self.getter_perf = GetterPerformanceEvaluator()
+    def __init__(self, options=DEFAULT_OPTIONS, diffs="all",
+                 max_diffs=DEFAULT_MAX_DIFFS, log_limit=None):
+        # log_limit: matched, missing and spurious entities logged per
+        #   resource type, after a summary line (None for all)
+        if diffs not in DIFF_MODES:
+            raise ValueError("unknown diff mode: " + repr(diffs))
+        self.options = options
+        self.log_limit = log_limit
+        args = (diffs, max_diffs)
+        self.node_perf = NodePerformanceEvaluator(*args)
+        self.param_perf = ParamPerformanceEvaluator(*args)
+        self.pub_perf = PubPerformanceEvaluator(*args)
+        self.sub_perf = SubPerformanceEvaluator(*args)
+        self.cli_perf = ClientPerformanceEvaluator(*args)
+        self.srv_perf = ServerPerformanceEvaluator(*args)
+        self.setter_perf = SetterPerformanceEvaluator(*args)
+        self.getter_perf = GetterPerformanceEvaluator(*args)
 
     def report(self, config, truth, iface):
         # ---- SETUP PHASE ----------------------------------------------------
         start_time = timer()
-        match_data = matching_by_name_type_loc(config, truth, iface)
+        options = self.options
+        if options.solver == "approx":
+            # the time budget starts now
+            options = options.replace(
+                approx=ApproxRecorder(options.time_budget))
+        with span("match", "phase"):
+            match_data = matching_by_name_type_loc(config, truth, iface,
+                options=options)
         end_time = timer()
         match_time = end_time - start_time
         self._log_match_data(match_data, iface)
         # ---- REPORT PHASE ---------------------------------------------------
+        approximate = {}
+        if options.approx is not None:
+            approximate = dict(options.approx.bounds)
+        return self.evaluate(match_data, match_time=match_time,
+                             approximate=approximate)
+
+    def evaluate(self, match_data, match_time=0.0, approximate=None):
+        # Returns the PerformanceReport of a matching (GraphData) computed
+        # elsewhere, in `match_time` seconds, with the report time and the
+        # bounds of any `approximate` resource types.
         start_time = timer()
-        res = self._resource_reports(match_data)
-        agg = self._aggregate_reports()
-        end_time = timer()
-        report_time = end_time - start_time
-        # ---- RETURN PHASE ---------------------------------------------------
-        return PerformanceReport(agg, res, match_time, report_time)
+        with span("report", "phase"):
+            res = self._resource_reports(match_data)
+            with span("aggregate metrics", "report"):
+                table = MetricsTable.from_evaluators(self._evaluators())
+                agg = table.aggregate_report()
+            with span("graph edit distance", "report"):
+                ged = table.edit_distance()
+        report_time = timer() - start_time
+        return PerformanceReport(agg, res, match_time, report_time,
+            match_data, table, dict(approximate or {}), ged)
+
+    def _evaluators(self):
+        # in the order of ResourceReport
+        return (self.node_perf, self.param_perf, self.pub_perf,
+                self.sub_perf, self.cli_perf, self.srv_perf,
+                self.setter_perf, self.getter_perf)
 
     def _resource_reports(self, match_data):
-        return ResourceReport(
-            self.node_perf.report(match_data.nodes),
-            self.param_perf.report(match_data.parameters),
-            self.pub_perf.report(match_data.publishers),
-            self.sub_perf.report(match_data.subscribers),
-            self.cli_perf.report(match_data.clients),
-            self.srv_perf.report(match_data.servers),
-            self.setter_perf.report(match_data.setters),
-            self.getter_perf.report(match_data.getters))
-
-    def _aggregate_reports(self):
-        overall_metrics = self._combined_metrics((
-            self.node_perf, self.param_perf,
-            self.pub_perf, self.sub_perf, self.cli_perf,
-            self.srv_perf, self.setter_perf, self.getter_perf),
-            all_attrs=False)
-        launch_metrics = self._combined_metrics((
-            self.node_perf, self.param_perf),
-            all_attrs=False)
-        source_metrics = self._combined_metrics((
-            self.pub_perf, self.sub_perf, self.cli_perf, self.srv_perf,
-            self.setter_perf, self.getter_perf),
-            all_attrs=False)
-        topic_metrics = self._combined_metrics((
-            self.pub_perf, self.sub_perf))
-        service_metrics = self._combined_metrics((
-            self.cli_perf, self.srv_perf))
-        param_metrics = self._combined_metrics((
-            self.setter_perf, self.getter_perf))
-        return AggregateReport(overall_metrics, launch_metrics, source_metrics,
-            topic_metrics, service_metrics, param_metrics)
-
-    def _combined_metrics(self, perfs, all_attrs=True):
-        if all_attrs:
-            keys = list(perfs[0].metrics.keys())
-        else:
-            keys = PerformanceEvaluator.main_attrs
-        r = {}
-        for key in keys:
-            m = Metrics()
-            for perf in perfs:
-                m.add(perf.get_metrics(key))
-            r[key] = m.as_tuple()
-        m = perfs[0].combined_metrics()
-        for i in range(1, len(perfs)):
-            m.add(perfs[i].combined_metrics())
-        r["*"] = m.as_tuple()
+        return ResourceReport(*(
+            self._evaluate(resource, evaluator, M)
+            for resource, evaluator, M in zip(ResourceReport._fields,
+                self._evaluators(), match_data)))
+
+    def _evaluate(self, resource, evaluator, M):
+        with span("evaluate " + resource, "report",
+                  matches=len(M.matches), missing=len(M.missing),
+                  spurious=len(M.spurious)) as s:
+            r = evaluator.report(M)
+            s.count(diffs=sum(r.diff_counts.values()))
         return r
 
     def _log_match_data(self, match_data, iface):
-        for i in range(len(match_data)):
-            m = match_data[i]
-            t = match_data._fields[i]
-            for u, v in m.matches:
-                iface.log_debug("matched {} {!r} and {!r}".format(
-                    t, u.rosname, v.rosname))
-            for u in m.missing:
-                iface.log_debug("missing {} {!r}".format(t, u.rosname))
-            for u in m.spurious:
-                iface.log_debug("spurious {} {!r}".format(t, u.rosname))
-
-
-def calc_performance(config, truth, iface):
-    g = GraphDiffCalculator()
+        log = DebugLog(iface)
+        if not log.enabled:
+            return
+        limit = self.log_limit
+        for t, m in zip(match_data._fields, match_data):
+            log("{}: {} matched, {} missing, {} spurious", t,
+                len(m.matches), len(m.missing), len(m.spurious))
+            log.items("matched " + t, m.matches,
+                lambda uv: "matched {} {!r} and {!r}".format(
+                    t, uv[0].rosname, uv[1].rosname), limit)
+            log.items("missing " + t, m.missing,
+                lambda u: "missing {} {!r}".format(t, u.rosname), limit)
+            log.items("spurious " + t, m.spurious,
+                lambda u: "spurious {} {!r}".format(t, u.rosname), limit)
+
+
+def calc_performance(config, truth, iface, options=DEFAULT_OPTIONS,
+                     diffs="all", max_diffs=DEFAULT_MAX_DIFFS,
+                     log_limit=None):
+    g = GraphDiffCalculator(options=options, diffs=diffs,
+                            max_diffs=max_diffs, log_limit=log_limit)
     return g.report(config, truth, iface)
 
 
+###############################################################################
+# Metrics Table
+###############################################################################
+
+COUNT_KINDS = ("cor", "inc", "par", "mis", "spu")
+
+RESOURCE_TYPES = ResourceReport._fields
+
+# every attribute of every resource type, in the order of the evaluators
+METRIC_ATTRS = ("rosname", "rostype", "traceability", "conditions",
+                "args", "remaps", "original_name", "queue_size", "latched",
+                "value")
+
+# aggregate -> (resource types, all attributes of the first type?)
+# otherwise, only the main attributes of PerformanceEvaluator
+AGGREGATES = (
+    ("overall", RESOURCE_TYPES, False),
+    ("launch", ("node", "parameter"), False),
+    ("source", RESOURCE_TYPES[2:], False),
+    ("topics", ("publisher", "subscriber"), True),
+    ("services", ("client", "server"), True),
+    ("params", ("setter", "getter"), True),
+)
+
+
+class MetricsTable(object):
+    # COR/INC/PAR/MIS/SPU counts in a single integer array, indexed by
+    # (resource type, attribute, count kind); see RESOURCE_TYPES,
+    # METRIC_ATTRS and COUNT_KINDS. Stacked tables (e.g., of several
+    # configurations) have leading axes, `total()` sums them up.
+    # Undefined attributes of a resource type are always zero.
+    __slots__ = ("counts", "attrs")
+
+    def __init__(self, counts, attrs):
+        self.counts = counts
+        # resource type index -> tuple of the indices of its attributes
+        self.attrs = attrs
+
+    @classmethod
+    def from_evaluators(cls, perfs):
+        counts = np.zeros((len(RESOURCE_TYPES), len(METRIC_ATTRS),
+                           len(COUNT_KINDS)), dtype=np.int64)
+        attrs = []
+        for r, perf in enumerate(perfs):
+            indices = []
+            for attr, m in perf.metrics.items():
+                a = METRIC_ATTRS.index(attr)
+                counts[r, a] = (m.cor, m.inc, m.par, m.mis, m.spu)
+                indices.append(a)
+            attrs.append(tuple(indices))
+        return cls(counts, tuple(attrs))
+
+    @classmethod
+    def stack(cls, tables):
+        tables = list(tables)
+        return cls(np.stack([t.counts for t in tables]), tables[0].attrs)
+
+    def total(self):
+        counts = self.counts.reshape((-1,) + self.counts.shape[-3:])
+        return MetricsTable(counts.sum(axis=0), self.attrs)
+
+    def group_counts(self, resources, attrs):
+        # Returns counts (..., len(attrs) + 1, kind) of the given resource
+        # types, per attribute, plus all attributes combined at the end.
+        rs = [RESOURCE_TYPES.index(r) for r in resources]
+        counts = self.counts[..., rs, :, :].sum(axis=-3)
+        combined = counts.sum(axis=-2)[..., np.newaxis, :]
+        return np.concatenate((counts[..., attrs, :], combined), axis=-2)
+
+    def aggregate(self, resources, all_attrs=True):
+        # {attribute: MetricsTuple, "*": MetricsTuple}, unstacked tables only
+        if all_attrs:
+            attrs = self.attrs[RESOURCE_TYPES.index(resources[0])]
+        else:
+            attrs = tuple(METRIC_ATTRS.index(attr)
+                          for attr in PerformanceEvaluator.main_attrs)
+        counts = self.group_counts(resources, attrs)
+        keys = [METRIC_ATTRS[a] for a in attrs] + ["*"]
+        return dict(zip(keys, metrics_tuples(counts)))
+
+    def aggregate_report(self):
+        return AggregateReport(*(self.aggregate(resources, all_attrs)
+                                 for _, resources, all_attrs in AGGREGATES))
+
+    def edit_distance(self):
+        # GraphEditDistance of floats, or of lists for stacked tables
+        counts = self.counts
+        names = counts[..., METRIC_ATTRS.index("rosname"), :]
+        # every match counts once towards the rosname metrics
+        matches = names[..., 0] + names[..., 1] + names[..., 2]
+        edits = names[..., 3] + names[..., 4]
+        # attribute differences of all matches, (..., resource, attribute)
+        diffs = (matches[..., np.newaxis] - counts[..., 0]
+                 - 0.5 * counts[..., 2])
+        values = []
+        for _, level_attrs in GED_LEVELS:
+            total = np.zeros(edits.shape, dtype=np.float64)
+            for r, attrs in enumerate(self.attrs):
+                if level_attrs is not None:
+                    attrs = [METRIC_ATTRS.index(a) for a in level_attrs]
+                total[..., r] = (len(attrs) * edits[..., r]
+                                 + diffs[..., r, list(attrs)].sum(axis=-1))
+            values.append(total.sum(axis=-1).tolist())
+        return GraphEditDistance(*values)
+
+
+# cross-configuration summary
+# `overall`: list of the overall MetricsTuple of each configuration
+# `total`: AggregateReport of the counts of all configurations
+Summary = namedtuple("Summary", ("names", "table", "overall", "total"))
+
+def summarize(names, reports):
+    table = MetricsTable.stack(report.table for report in reports)
+    counts = table.group_counts(RESOURCE_TYPES, ())
+    overall = metrics_tuples(counts[:, -1])
+    return Summary(list(names), table, overall,
+                   table.total().aggregate_report())
+
+
+def metric_scores(counts):
+    # Vectorized Metrics.precision, recall and f1 over counts (..., kind).
+    counts = np.asarray(counts)
+    cor, inc, par, mis, spu = (counts[..., i] for i in range(5))
+    hits = cor + 0.5 * par
+    act = cor + inc + par + spu
+    pos = cor + inc + par + mis
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pre = np.where(act == 0, 1.0, hits / np.maximum(act, 1))
+        rec = np.where(pos == 0, 1.0, hits / np.maximum(pos, 1))
+        f1 = np.where(pre + rec == 0.0, 0.0, 2 * pre * rec / (pre + rec))
+    return pre, rec, f1
+
+def metrics_tuples(counts):
+    # counts (n, kind) -> list of n MetricsTuple
+    pre, rec, f1 = metric_scores(counts)
+    return [MetricsTuple(*([int(x) for x in row] + [float(p), float(r),
+                                                    float(f)]))
+            for row, p, r, f in zip(counts.tolist(), pre, rec, f1)]
+
+
+###############################################################################
+# Graph Edit Distance
+###############################################################################
+
+# The model and the ground truth are attributed graphs, with nodes and
+# parameters as vertices and links as edges. Exact edit distance is out of
+# reach at our sizes, so, as in the bipartite approximation of Riesen and
+# Bunke, this is the cost of the edit path induced by an assignment of
+# vertices, each pair of which also assigns the edges of both vertices.
+# That is the matching of the report (node pairs and the link matching of
+# each of them), so nothing is solved again, and the distance comes from
+# the metric counts alone. Like any edit path, it is an upper bound.
+# Each compared attribute costs 1: inserting or deleting an entity costs
+# the number of its attributes, and substituting an entity costs the number
+# of attributes that differ, with partial agreement (e.g. a wildcard
+# rosname) counting half, which never exceeds a deletion plus an insertion.
+# Levels with more attributes never have a smaller distance.
+
+GraphEditDistance = namedtuple("GraphEditDistance", ("simple", "mid", "full"))
+
+# level -> compared attributes (None for all attributes of the resource type)
+GED_LEVELS = (
+    ("simple", ("rosname",)),
+    ("mid", ("rosname", "rostype")),
+    ("full", None),
+)
+
+
 ###############################################################################
 # Comparison Functions
 ###############################################################################
@@ -218,10 +413,15 @@ class Metrics(object):
 
 class PerformanceEvaluator(object):
     resource_type = "Resource"
-    __slots__ = ("metrics", "diffs")
+    __slots__ = ("metrics", "diffs", "diff_counts", "diff_mode", "max_diffs",
+                 "_samples", "_rng", "_found")
     main_attrs = ("rosname", "rostype", "traceability", "conditions")
     snd_attrs = ()
 
+    def __init__(self, diff_mode="all", max_diffs=DEFAULT_MAX_DIFFS):
+        self.diff_mode = diff_mode
+        self.max_diffs = max_diffs
+
     def report(self, M):
         self._reset()
         self._count_missing(M)
@@ -234,7 +434,11 @@ class PerformanceEvaluator(object):
             self._count_secondary_attrs(u, v)
         metrics = {key: m.as_tuple() for key, m in self.metrics.items()}
         metrics["*"] = self.combined_metrics().as_tuple()
-        return Report(metrics, self.diffs)
+        if self.diff_mode == "sample":
+            samples = [d for sample in self._samples.values() for d in sample]
+            samples.sort(key=lambda d: d[0]) # in the order they were found
+            self.diffs = [d for _, d in samples]
+        return Report(metrics, self.diffs, self.diff_counts)
 
     def get_metrics(self, attr):
         metrics = self.metrics.get(attr)
@@ -250,6 +454,11 @@ class PerformanceEvaluator(object):
 
     def _reset(self):
         self.diffs = []
+        self.diff_counts = {}
+        self._samples = {}
+        self._found = 0
+        # same seed for every report, so that samples are reproducible
+        self._rng = random.Random(self.resource_type)
         self.metrics = {}
         for attr in self.main_attrs:
             self.metrics[attr] = Metrics()
@@ -260,6 +469,8 @@ class PerformanceEvaluator(object):
         if M.missing:
             for m in self.metrics.values():
                 m.mis += len(M.missing)
+            if self.diff_mode == "none":
+                return
             for v in M.missing:
                 self._diff(v.rosname, "*", None, v)
 
@@ -267,6 +478,8 @@ class PerformanceEvaluator(object):
         if M.spurious:
             for m in self.metrics.values():
                 m.spu += len(M.spurious)
+            if self.diff_mode == "none":
+                return
             for u in M.spurious:
                 self._diff(u.rosname, "*", u, None)
 
@@ -317,6 +530,11 @@ class PerformanceEvaluator(object):
         while queue:
             new_queue = []
             for c1, c2 in queue:
+                if c1 is c2 and isinstance(c1, ConditionTree):
+                    # hash-consed, identical subtrees: every guard matches
+                    n += c1.size
+                    p += c1.size
+                    continue
                 for g, child1 in c1.items():
                     child2 = c2.get(g)
                     if child2 is None:
@@ -362,7 +580,35 @@ class PerformanceEvaluator(object):
             self._diff(v.rosname, attr.replace("_", " "), p, g)
 
     def _diff(self, rosname, attr, p, g):
-        self.diffs.append(Diff(self.resource_type, rosname, attr, p, g))
+        mode = self.diff_mode
+        if mode == "none":
+            return
+        if attr == "*":
+            category = "missing" if p is None else "spurious"
+        else:
+            category = attr
+        n = self.diff_counts.get(category, 0) + 1
+        self.diff_counts[category] = n
+        self._found += 1
+        if mode == "all":
+            self.diffs.append(Diff(self.resource_type, rosname, attr, p, g))
+            return
+        # reservoir sampling, (index, Diff) pairs
+        sample = self._samples.get(category)
+        if sample is None:
+            sample = []
+            self._samples[category] = sample
+        if len(sample) < self.max_diffs:
+            i = len(sample)
+        else:
+            i = self._rng.randrange(n)
+            if i >= self.max_diffs:
+                return
+        d = (self._found, Diff(self.resource_type, rosname, attr, p, g))
+        if i < len(sample):
+            sample[i] = d
+        else:
+            sample.append(d)
 
 
 class NodePerformanceEvaluator(PerformanceEvaluator):
@@ -27,23 +27,59 @@
 
 from __future__ import print_function
 from past.builtins import basestring
-from builtins import range
-from collections import namedtuple
+from builtins import range, zip
+from collections import Counter, namedtuple
+from itertools import count
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+import logging
 import re
+import time
 
-import networkx as nx
+import numpy as np
 
-from .nx_patch import minimum_weight_full_matching
+from .assignment import (
+    approx_assignment, capped_assignment, sparse_assignment,
+    threshold_assignment
+)
+from .tracing import span
 
 
 ###############################################################################
 # Globals
 ###############################################################################
 
-def _noop(msg):
-    pass
+# Debug messages are only formatted if the "haros_plugin_model_ged" logger
+# is enabled for DEBUG (HAROS sets the level of the root logger), whatever
+# `iface.log_debug` does with them. Arguments are formatted lazily.
+LOGGER = logging.getLogger("haros_plugin_model_ged")
 
-flog = _noop
+class DebugLog(object):
+    __slots__ = ("enabled", "_emit")
+
+    def __init__(self, iface=None):
+        self.enabled = (iface is not None
+                        and LOGGER.isEnabledFor(logging.DEBUG))
+        self._emit = iface.log_debug if self.enabled else None
+
+    def __call__(self, msg, *args):
+        if self.enabled:
+            self._emit(msg.format(*args) if args else msg)
+
+    def items(self, what, items, describe, limit=None):
+        # One message per item, up to `limit` (None for all), then a count
+        # of the items left out.
+        if not self.enabled:
+            return
+        n = len(items) if limit is None else min(limit, len(items))
+        for i in range(n):
+            self._emit(describe(items[i]))
+        if n < len(items):
+            self._emit("... and {} more {}".format(len(items) - n, what))
+
+NULL_LOG = DebugLog()
+
+flog = NULL_LOG
 
 INF = float("inf")
 
@@ -76,12 +112,14 @@ CliAttrs = namedtuple("CliSrvAttrs",
      "conditions"))
 
 SrvAttrs = CliAttrs
+CliSrvAttrs = CliAttrs # so that instances can be pickled
 
 SetAttrs = namedtuple("SetGetAttrs",
     ("key", "rosname", "rostype", "traceability", "original_name",
      "value", "conditions"))
 
 GetAttrs = SetAttrs
+SetGetAttrs = SetAttrs # so that instances can be pickled
 
 
 Guard = namedtuple("Guard",
@@ -91,128 +129,556 @@ Location = namedtuple("Location", ("package", "file", "line", "column"))
 
 Matching = namedtuple("Matching", ("matches", "missing", "spurious"))
 
+# converted ground truth: lists of NodeAttrs and ParamAttrs
+TruthData = namedtuple("TruthData", ("nodes", "parameters"))
+
+# converted HAROS configuration: lists of NodeAttrs and ParamAttrs
+ModelData = namedtuple("ModelData", ("nodes", "parameters"))
+
+
+class ConditionTree(object):
+    # Immutable mapping of Guard -> ConditionTree, hash-consed by
+    # `new_condition_tree()`, so that equal trees are usually the same object.
+    # `digest` is a Merkle hash of the whole tree, and `size` is the number
+    # of guards in it, so that identical subtrees are compared in O(1).
+    __slots__ = ("_children", "digest", "size")
+
+    def __init__(self, children):
+        self._children = children
+        self.digest = hash(frozenset(children.items()))
+        self.size = sum(1 + child.size for child in children.values())
+
+    def get(self, guard, default=None):
+        return self._children.get(guard, default)
+
+    def items(self):
+        return self._children.items()
+
+    def keys(self):
+        return self._children.keys()
+
+    def values(self):
+        return self._children.values()
+
+    def __getitem__(self, guard):
+        return self._children[guard]
+
+    def __contains__(self, guard):
+        return guard in self._children
+
+    def __iter__(self):
+        return iter(self._children)
+
+    def __len__(self):
+        return len(self._children)
+
+    def __bool__(self):
+        return bool(self._children)
+
+    __nonzero__ = __bool__
+
+    def __hash__(self):
+        return self.digest
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if isinstance(other, ConditionTree):
+            return (self.digest == other.digest
+                    and self._children == other._children)
+        if isinstance(other, dict):
+            return self._children == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __reduce__(self):
+        # hash values of strings differ between processes
+        return (new_condition_tree, (self._children,))
+
+    def __repr__(self):
+        return repr(self._children)
+
+
+class MatchOptions(object):
+    # solver:
+    #   "dense" - full cost matrix, split into below-threshold components
+    #   "sparse" - candidate pairs only, pruned by threshold and blocking keys
+    #   "auto" - "sparse" for problems of at least `sparse_min_size` pairs
+    #   "approx" - approximate solution (see `approx_assignment`) for
+    #     problems of at least `approx_min_size` pairs, "dense" otherwise
+    # workers: link matching runs in a pool of this many workers, if > 1
+    # pool: "process" or "thread"
+    # chunksize: link matching problems per pool task (None for automatic)
+    # cache: a MatchCache, to reuse the solutions of previous runs
+    # time_budget: seconds for approximate problems to improve their
+    #   solution (None for no limit), from the creation of `approx`
+    # approx: an ApproxRecorder, shared by the matchings of a run
+    __slots__ = ("solver", "sparse_min_size", "workers", "pool", "chunksize",
+                 "cache", "approx_min_size", "time_budget", "approx")
+
+    SOLVERS = ("dense", "sparse", "auto", "approx")
+    POOLS = ("process", "thread")
+
+    def __init__(self, solver="dense", sparse_min_size=250000, workers=1,
+                 pool="process", chunksize=None, cache=None,
+                 approx_min_size=250000, time_budget=None, approx=None):
+        if solver not in self.SOLVERS:
+            raise ValueError("unknown solver: {!r}".format(solver))
+        if pool not in self.POOLS:
+            raise ValueError("unknown pool: {!r}".format(pool))
+        self.solver = solver
+        self.sparse_min_size = sparse_min_size
+        self.workers = workers
+        self.pool = pool
+        self.chunksize = chunksize
+        self.cache = cache
+        self.approx_min_size = approx_min_size
+        self.time_budget = time_budget
+        self.approx = approx
+
+    def replace(self, **kwargs):
+        values = {attr: getattr(self, attr) for attr in self.__slots__}
+        values.update(kwargs)
+        return MatchOptions(**values)
+
+    def __getstate__(self):
+        return tuple(getattr(self, attr) for attr in self.__slots__)
+
+    def __setstate__(self, state):
+        for attr, value in zip(self.__slots__, state):
+            setattr(self, attr, value)
+
+DEFAULT_OPTIONS = MatchOptions()
+
+
+# Problems of a resource type (a GraphData field) solved approximately:
+# `cost` is their total cost (unmatched entities cost half the threshold),
+# which is at most `gap` above the optimum, and `complete` is False if the
+# deadline cut the search of any of them short.
+ApproxBound = namedtuple("ApproxBound",
+    ("problems", "cost", "gap", "complete"))
+
+class ApproxRecorder(object):
+    __slots__ = ("deadline", "resource", "bounds")
+
+    def __init__(self, time_budget=None):
+        if time_budget is None:
+            self.deadline = None
+        else:
+            self.deadline = time.time() + time_budget
+        self.resource = None
+        self.bounds = {} # resource type -> ApproxBound
+
+    def record(self, cost, lower, complete):
+        b = self.bounds.get(self.resource)
+        if b is None:
+            b = ApproxBound(0, 0.0, 0.0, True)
+        self.bounds[self.resource] = ApproxBound(b.problems + 1,
+            b.cost + cost, b.gap + cost - lower, b.complete and complete)
+
 
 ###############################################################################
 # Graph Matching
 ###############################################################################
 
-def matching_by_name(config, truth, iface=None):
-    return matching_by(config, truth, cost_rosname, iface=iface, t=3)
+def matching_by_name(config, truth, iface=None, options=DEFAULT_OPTIONS):
+    return matching_by(config, truth, cost_rosname,
+        iface=iface, t=3, options=options)
 
-def matching_by_name_type(config, truth, iface=None):
-    return matching_by(config, truth, cost_rosname_rostype, iface=iface, t=2*3)
+def matching_by_name_type(config, truth, iface=None,
+                          options=DEFAULT_OPTIONS):
+    return matching_by(config, truth, cost_rosname_rostype,
+        iface=iface, t=2*3, options=options)
 
-def matching_by_name_type_loc(config, truth, iface=None):
+def matching_by_name_type_loc(config, truth, iface=None,
+                              options=DEFAULT_OPTIONS):
     return matching_by(config, truth, cost_rosname_rostype_traceability,
-        iface=iface, t=5*2*3)
+        iface=iface, t=5*2*3, options=options)
 
-def matching_by_loc(config, truth, iface=None):
-    return matching_by(config, truth, cost_traceability_main, iface=iface, t=4)
+def matching_by_loc(config, truth, iface=None, options=DEFAULT_OPTIONS):
+    return matching_by(config, truth, cost_traceability_main,
+        iface=iface, t=4, options=options)
 
-def matching_by_loc_name(config, truth, iface=None):
+def matching_by_loc_name(config, truth, iface=None, options=DEFAULT_OPTIONS):
     return matching_by(config, truth, cost_traceability_rosname,
-        iface=iface, t=4*4)
+        iface=iface, t=4*4, options=options)
 
-def matching_by_loc_name_type(config, truth, iface=None):
+def matching_by_loc_name_type(config, truth, iface=None,
+                              options=DEFAULT_OPTIONS):
     return matching_by(config, truth, cost_traceability_rosname_rostype,
-        iface=iface, t=4*2*4)
-
-
-def matching_by(config, truth, cost_function, iface=None, t=INF):
-    global flog
-    if iface is None:
-        flog = _noop
+        iface=iface, t=4*2*4, options=options)
+
+
+def matching_by(config, truth, cost_function, iface=None, t=INF,
+                options=DEFAULT_OPTIONS):
+    _set_logger(iface)
+    if options.solver == "approx" and options.approx is None:
+        options = options.replace(approx=ApproxRecorder(options.time_budget))
+    with span("convert model", "convert") as s:
+        model = convert_model(config)
+        s.count(nodes=len(model.nodes), parameters=len(model.parameters))
+    with span("convert truth", "convert") as s:
+        truth = convert_truth(truth)
+        s.count(nodes=len(truth.nodes), parameters=len(truth.parameters))
+    with span("match nodes", "match", model=len(model.nodes),
+              truth=len(truth.nodes)) as s:
+        _approx_resource(options, "nodes")
+        M_nodes = _matching(model.nodes, truth.nodes, cost_function, t,
+                            options)
+        s.count(matches=len(M_nodes.matches))
+    with span("match parameters", "match", model=len(model.parameters),
+              truth=len(truth.parameters)) as s:
+        _approx_resource(options, "parameters")
+        M_params = _matching(model.parameters, truth.parameters,
+                             cost_function, t, options)
+        s.count(matches=len(M_params.matches))
+    if options.workers > 1:
+        # spans of the pool workers are not recorded
+        with span("match links", "match", problems=len(M_nodes.matches),
+                  workers=options.workers):
+            links = parallel_link_matching(M_nodes, LINK_ATTRS,
+                cost_function, t=t, options=options)
     else:
-        flog = iface.log_debug
-    M_nodes = node_matching(config.nodes.enabled,
-        truth["nodes"], cost_function, t=t)
-    M_params = param_matching(config.parameters.enabled,
-        truth["parameters"], cost_function, t=t)
-    return GraphData(M_nodes, M_params,
-        link_matching(M_nodes, "publishers", cost_function, t=t),
-        link_matching(M_nodes, "subscribers", cost_function, t=t),
-        link_matching(M_nodes, "clients", cost_function, t=t),
-        link_matching(M_nodes, "servers", cost_function, t=t),
-        link_matching(M_nodes, "setters", cost_function, t=t),
-        link_matching(M_nodes, "getters", cost_function, t=t))
+        links = [link_matching(M_nodes, attr, cost_function, t=t,
+                               options=options)
+                 for attr in LINK_ATTRS]
+    return GraphData(M_nodes, M_params, *links)
+
+LINK_ATTRS = ("publishers", "subscribers", "clients", "servers",
+              "setters", "getters")
+
+
+def matching_by_strategies(config, truth, strategies=None, iface=None,
+                           options=DEFAULT_OPTIONS):
+    # Returns a dict {strategy name: GraphData}, for the given strategies
+    # (all of STRATEGIES by default), converting the model and the ground
+    # truth only once and sharing the component costs between strategies.
+    _set_logger(iface)
+    if strategies is None:
+        strategies = list(STRATEGIES.keys())
+    matcher = StrategyMatcher(config, truth, options=options)
+    return {name: matcher.match(name) for name in strategies}
+
+def _set_logger(iface):
+    global flog
+    flog = NULL_LOG if iface is None else DebugLog(iface)
 
 
 ###############################################################################
 # Matching Functions
 ###############################################################################
 
-def node_matching(config_nodes, truth_nodes, cost_function, t=INF):
-    lhs = [convert_haros_node(node) for node in config_nodes]
-    rhs = [convert_truth_node(rosname, data)
-           for rosname, data in truth_nodes.items()]
-    return _matching(lhs, rhs, cost_function, t)
+def node_matching(config_nodes, truth_nodes, cost_function, t=INF,
+        options=DEFAULT_OPTIONS):
+    lhs = _haros_nodes(config_nodes)
+    rhs = _truth_nodes(truth_nodes)
+    _approx_resource(options, "nodes")
+    return _matching(lhs, rhs, cost_function, t, options)
+
+def param_matching(config_params, truth_params, cost_function, t=INF,
+        options=DEFAULT_OPTIONS):
+    lhs = _haros_params(config_params)
+    rhs = _truth_params(truth_params)
+    _approx_resource(options, "parameters")
+    return _matching(lhs, rhs, cost_function, t, options)
+
+def link_matching(M_nodes, attr, cost_function, t=INF,
+        options=DEFAULT_OPTIONS):
+    with span("match " + attr, "match", problems=len(M_nodes.matches)) as s:
+        _approx_resource(options, attr)
+        M = Matching([], [], [])
+        for node in M_nodes.missing:
+            M.missing.extend(getattr(node, attr))
+        for node in M_nodes.spurious:
+            M.spurious.extend(getattr(node, attr))
+        for node, gold in M_nodes.matches:
+            lhs = getattr(node, attr)
+            rhs = getattr(gold, attr)
+            m = _matching(lhs, rhs, cost_function, t, options)
+            M.matches.extend(m.matches)
+            M.missing.extend(m.missing)
+            M.spurious.extend(m.spurious)
+        s.count(matches=len(M.matches), missing=len(M.missing),
+                spurious=len(M.spurious))
+    return M
+
+def parallel_link_matching(M_nodes, attrs, cost_function, t=INF,
+        options=DEFAULT_OPTIONS):
+    # Same results as `link_matching` for each attribute in `attrs`, but
+    # the assignment problem of each matched node pair is solved in a pool.
+    # Workers only return indices, which are merged back in the same order.
+    # Cached solutions are looked up (and stored) here, not in the workers.
+    # Workers solve every problem exactly, even with the "approx" solver.
+    cache = _match_cache(options, cost_function)
+    worker_options = options.replace(cache=None, approx=None)
+    if options.solver == "approx":
+        worker_options = worker_options.replace(solver="dense")
+    slots = []
+    problems = []
+    for attr in attrs:
+        for node, gold in M_nodes.matches:
+            lhs = getattr(node, attr)
+            rhs = getattr(gold, attr)
+            if lhs and rhs:
+                key = solution = None
+                if cache is not None:
+                    key = cache.problem_key(lhs, rhs, cost_function, t,
+                                            options.solver)
+                    solution = cache.get(key)
+                if solution is None:
+                    problems.append((lhs, rhs, cost_function, t,
+                                     worker_options))
+                slots.append([key, solution])
+    solutions = iter(_pool_map(_assignment_task, problems, options))
+    for slot in slots:
+        if slot[1] is None:
+            slot[1] = next(solutions)
+            if cache is not None:
+                cache.put(slot[0], *slot[1])
+    slots = iter(slots)
+    result = []
+    for attr in attrs:
+        M = Matching([], [], [])
+        for node in M_nodes.missing:
+            M.missing.extend(getattr(node, attr))
+        for node in M_nodes.spurious:
+            M.spurious.extend(getattr(node, attr))
+        for node, gold in M_nodes.matches:
+            lhs = getattr(node, attr)
+            rhs = getattr(gold, attr)
+            if lhs and rhs:
+                rows, cols = next(slots)[1]
+                m = _build_matching(lhs, rhs, rows, cols)
+            else:
+                m = _matching(lhs, rhs, cost_function, t, options)
+            M.matches.extend(m.matches)
+            M.missing.extend(m.missing)
+            M.spurious.extend(m.spurious)
+        result.append(M)
+    return result
+
+
+def _haros_nodes(config_nodes):
+    return [convert_haros_node(node) for node in config_nodes]
 
-def param_matching(config_params, truth_params, cost_function, t=INF):
-    lhs = [convert_haros_param(param) for param in config_params
-           if param.launch is not None]
+def _truth_nodes(truth_nodes):
+    # entries loaded from truth files are converted already
+    return [data if isinstance(data, NodeAttrs)
+            else convert_truth_node(rosname, data)
+            for rosname, data in truth_nodes.items()]
+
+def _haros_params(config_params):
+    return [convert_haros_param(param) for param in config_params
+            if param.launch is not None]
+
+def _truth_params(truth_params):
     rhs = []
     for rosname, data in truth_params.items():
-        for param in convert_truth_params(rosname, data):
+        if isinstance(data, dict):
+            data = convert_truth_params(rosname, data)
+        for param in data:
             rhs.append(param)
-    return _matching(lhs, rhs, cost_function, t)
-
-def link_matching(M_nodes, attr, cost_function, t=INF):
-    M = Matching([], [], [])
-    for node in M_nodes.missing:
-        M.missing.extend(getattr(node, attr))
-    for node in M_nodes.spurious:
-        M.spurious.extend(getattr(node, attr))
-    for node, gold in M_nodes.matches:
-        lhs = getattr(node, attr)
-        rhs = getattr(gold, attr)
-        m = _matching(lhs, rhs, cost_function, t)
-        M.matches.extend(m.matches)
-        M.missing.extend(m.missing)
-        M.spurious.extend(m.spurious)
-    return M
+    return rhs
 
 
-def _matching(lhs, rhs, cost_function, t):
+def _matching(lhs, rhs, cost_function, t, options=DEFAULT_OPTIONS):
     if lhs and not rhs:
         return Matching([], [], list(lhs))
     if rhs and not lhs:
         return Matching([], list(rhs), [])
     if not lhs and not rhs:
         return Matching([], [], [])
-    G = nx.Graph()
-    top = []
-    for v in rhs:
-        G.add_node(v.key, data=v, bipartite=1)
-        top.append(v.key)
-    for u in lhs:
-        G.add_node(u.key, data=u, bipartite=0)
-        for v in rhs:
-            weight = cost_function(u, v)
-            G.add_edge(u.key, v.key, weight=weight)
-    M = minimum_weight_full_matching(G, top_nodes=top)
-    # The matching is returned as a dictionary such that
-    #   M[u] == v if node u is matched to node v.
-    # Unmatched nodes do not occur as a key.
+    rows, cols = _assignment(lhs, rhs, cost_function, t, options)
+    return _build_matching(lhs, rhs, rows, cols)
+
+def _assignment(lhs, rhs, cost_function, t, options):
+    # approximate solutions depend on the time left, and are not cached
+    cache = _match_cache(options, cost_function)
+    if cache is None or options.solver == "approx":
+        return _solve(lhs, rhs, cost_function, t, options)
+    key = cache.problem_key(lhs, rhs, cost_function, t, options.solver)
+    solution = cache.get(key)
+    if solution is None:
+        solution = _solve(lhs, rhs, cost_function, t, options)
+        cache.put(key, *solution)
+    return solution
+
+def _solve(lhs, rhs, cost_function, t, options):
+    # Pairs of equal entities are committed up front, when that is safe,
+    # and only the remaining entities are handed to the solver.
+    if cost_function not in EXACT_JOIN_COSTS:
+        return _solve_residual(lhs, rhs, cost_function, t, options)
+    with span("exact pairs", "cost", rows=len(lhs), cols=len(rhs)) as s:
+        pairs = _exact_pairs(lhs, rhs, cost_function)
+        s.count(pairs=len(pairs))
+    if not pairs:
+        return _solve_residual(lhs, rhs, cost_function, t, options)
+    joined_lhs = set(i for i, j in pairs)
+    joined_rhs = set(j for i, j in pairs)
+    rest_lhs = [i for i in range(len(lhs)) if i not in joined_lhs]
+    rest_rhs = [j for j in range(len(rhs)) if j not in joined_rhs]
+    rows = [i for i, j in pairs]
+    cols = [j for i, j in pairs]
+    if rest_lhs and rest_rhs:
+        sub_rows, sub_cols = _solve_residual([lhs[i] for i in rest_lhs],
+            [rhs[j] for j in rest_rhs], cost_function, t, options)
+        rows.extend(rest_lhs[i] for i in sub_rows.tolist())
+        cols.extend(rest_rhs[j] for j in sub_cols.tolist())
+    return (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp))
+
+def _exact_pairs(lhs, rhs, cost_function):
+    # Returns the (i, j) pairs of zero cost whose rosname no other entity
+    # has, on either side. Some optimal assignment contains all of them,
+    # if rosname is the leading component of the cost (see EXACT_JOIN_COSTS):
+    # any other rhs[j'] costs at least as much for lhs[i] as for any other
+    # lhs[i'], so swapping lhs[i] back to rhs[j] never costs more.
+    lhs_count = Counter(u.rosname for u in lhs)
+    rhs_index = {}
+    for j, v in enumerate(rhs):
+        rhs_index[v.rosname] = -1 if v.rosname in rhs_index else j
+    pairs = []
+    for i, u in enumerate(lhs):
+        j = rhs_index.get(u.rosname, -1)
+        if (j >= 0 and lhs_count[u.rosname] == 1 and "?" not in u.rosname
+                and cost_function(u, rhs[j]) == 0):
+            pairs.append((i, j))
+    return pairs
+
+def _solve_residual(lhs, rhs, cost_function, t, options):
+    n = len(lhs)
+    m = len(rhs)
+    if options.solver == "approx" and n * m >= options.approx_min_size:
+        return _approx_solve(lhs, rhs, cost_function, t, options)
+    if _use_sparse_solver(lhs, rhs, options):
+        with span("candidate pairs", "cost", rows=n, cols=m) as s:
+            I, J, C = _candidate_pairs(lhs, rhs, cost_function, t)
+            s.count(pairs=len(C))
+        with span("assignment", "solve", rows=n, cols=m, pairs=len(C)) as s:
+            solution = sparse_assignment(n, m, I, J, C, t)
+            s.count(assigned=len(solution[0]))
+        return solution
+    with span("cost matrix", "cost", rows=n, cols=m):
+        W = _cost_matrix(lhs, rhs, cost_function)
+    solve = capped_assignment
+    cache = _match_cache(options, cost_function)
+    if cache is not None:
+        solve = cache.block_solver(lhs, rhs, cost_function, t, solve)
+    with span("assignment", "solve", rows=n, cols=m) as s:
+        solution = threshold_assignment(W, t, solve=solve)
+        s.count(assigned=len(solution[0]))
+    return solution
+
+def _approx_solve(lhs, rhs, cost_function, t, options):
+    approx = options.approx
+    if approx is None:
+        # the time budget is for this problem alone
+        approx = ApproxRecorder(options.time_budget)
+    n = len(lhs)
+    m = len(rhs)
+    with span("candidate pairs", "cost", rows=n, cols=m) as s:
+        I, J, C = _candidate_pairs(lhs, rhs, cost_function, t)
+        s.count(pairs=len(C))
+    with span("approximate assignment", "solve", rows=n, cols=m,
+              pairs=len(C)) as s:
+        rows, cols, cost, lower, complete = approx_assignment(n, m, I, J, C,
+            t, deadline=approx.deadline)
+        s.count(assigned=len(rows), gap=cost - lower, complete=complete)
+    approx.record(cost, lower, complete)
+    return (rows, cols)
+
+def _match_cache(options, cost_function):
+    # custom cost functions without a stable name are never cached
+    cache = options.cache
+    if cache is not None and cache.accepts(cost_function):
+        return cache
+    return None
+
+def _approx_resource(options, resource):
+    if options.approx is not None:
+        options.approx.resource = resource
+
+def _assignment_task(args):
+    return _assignment(*args)
+
+def _build_matching(lhs, rhs, rows, cols):
+    # Every assigned pair is below the threshold.
+    # assigned[i] == j if lhs[i] is assigned to rhs[j], -1 if unassigned.
+    assigned = [-1] * len(lhs)
+    for i, j in zip(rows.tolist(), cols.tolist()):
+        assigned[i] = j
+    used = [False] * len(rhs)
     matched = []
     missed = []
     spurious = []
-    for u in lhs:
-        key = M.get(u.key)
-        if key is None:
+    for i, u in enumerate(lhs):
+        j = assigned[i]
+        if j < 0:
             spurious.append(u)
         else:
-            v = G.nodes[key]["data"]
-            weight = G[u.key][key]["weight"]
-            if weight < t:
-                matched.append((u, v))
-            else:
-                missed.append(v)
-                spurious.append(u)
-    for v in rhs:
-        if v.key not in M:
+            used[j] = True
+            matched.append((u, rhs[j]))
+    for j, v in enumerate(rhs):
+        if not used[j]:
             missed.append(v)
     return Matching(matched, missed, spurious)
 
+def _cost_matrix(lhs, rhs, cost_function):
+    components = COST_COMPONENTS.get(cost_function)
+    if components is None or len(lhs) * len(rhs) < VECTORIZE_MIN_SIZE:
+        W = np.empty((len(lhs), len(rhs)), dtype=np.float64)
+        for i, u in enumerate(lhs):
+            row = W[i]
+            for j, v in enumerate(rhs):
+                row[j] = cost_function(u, v)
+        return W
+    L = EntityTable(lhs)
+    R = EntityTable(rhs)
+    I = np.arange(len(lhs))[:, np.newaxis]
+    J = np.arange(len(rhs))[np.newaxis, :]
+    return composite_cost(components, L, R, I, J)
+
+def _pool_map(f, items, options):
+    if not items:
+        return []
+    workers = min(options.workers, len(items))
+    chunksize = options.chunksize
+    if chunksize is None:
+        chunksize = max(1, len(items) // (4 * workers))
+    if options.pool == "thread":
+        pool = ThreadPool(workers)
+    else:
+        pool = Pool(workers)
+    try:
+        return pool.map(f, items, chunksize)
+    finally:
+        pool.close()
+        pool.join()
+
+def _use_sparse_solver(lhs, rhs, options):
+    if options.solver == "auto":
+        return len(lhs) * len(rhs) >= options.sparse_min_size
+    return options.solver == "sparse"
+
+def _candidate_pairs(lhs, rhs, cost_function, t):
+    # Returns arrays (I, J, C) of the pairs lhs[I[k]], rhs[J[k]] that may
+    # cost less than `t`, along with their costs C[k].
+    components = COST_COMPONENTS.get(cost_function)
+    if components is None:
+        W = _cost_matrix(lhs, rhs, cost_function)
+        I, J = np.nonzero(W < t)
+        return I, J, W[I, J]
+    L = EntityTable(lhs)
+    R = EntityTable(rhs)
+    I, J = blocked_pairs(components, L, R, t)
+    C = composite_cost(components, L, R, I, J)
+    keep = C < t
+    return I[keep], J[keep], C[keep]
+
 
 ###############################################################################
 # Cost Functions
@@ -316,10 +782,471 @@ def cost_traceability_rosname_rostype(u, v):
     return cost + cost_rostype(u, v)
 
 
+###############################################################################
+# Vectorized Cost Functions
+###############################################################################
+
+# Below this number of pairs, encoding the entities costs more than it saves.
+VECTORIZE_MIN_SIZE = 16
+
+class EntityTable(object):
+    # Struct-of-arrays view over a list of entities.
+    # String attributes are encoded as integer codes from a vocabulary that
+    # must be shared by every table taking part in the same comparison,
+    # which is the global `STRING_CODES` by default.
+    # Unknown (None) lines and columns are encoded as NaN.
+    __slots__ = ("size", "rosname", "wildcard", "patterns", "multi_wildcard",
+                 "expected", "alt", "rostype", "package", "file", "line",
+                 "column")
+
+    def __init__(self, entities, vocab=None):
+        if vocab is None:
+            vocab = STRING_CODES
+        n = len(entities)
+        self.size = n
+        self.rosname = _encode([u.rosname for u in entities], vocab)
+        self.rostype = _encode([u.rostype for u in entities], vocab)
+        locs = [u.traceability for u in entities]
+        self.package = _encode([loc.package for loc in locs], vocab)
+        self.file = _encode([loc.file for loc in locs], vocab)
+        self.line = _encode_numbers([loc.line for loc in locs])
+        self.column = _encode_numbers([loc.column for loc in locs])
+        # rosname_match() arguments, when this table is the ground truth
+        self.expected = []
+        self.alt = []
+        for u in entities:
+            try:
+                self.expected.append(getattr(u, "original_name"))
+                self.alt.append(u.rosname)
+            except AttributeError:
+                self.expected.append(u.rosname)
+                self.alt.append(None)
+        # rosname patterns, when this table is the prediction
+        self.wildcard = np.zeros(n, dtype=bool)
+        self.multi_wildcard = np.zeros(n, dtype=bool)
+        self.patterns = [None] * n
+        for i in range(n):
+            rosname = entities[i].rosname
+            k = rosname.count("?")
+            if k > 0:
+                self.wildcard[i] = True
+                self.multi_wildcard[i] = k > 1
+                self.patterns[i] = rosname_pattern(rosname)
+
+    def has_unknown_traceability(self):
+        return bool((self.package < 0).any() or (self.file < 0).any()
+                    or np.isnan(self.line).any()
+                    or np.isnan(self.column).any())
+
+
+def composite_cost(components, L, R, I, J):
+    # `I` and `J` are broadcastable arrays of row indices into `L` and `R`.
+    # Returns an array with their broadcast shape.
+    W = None
+    for weight, name in components:
+        C = COMPONENT_FUNCTIONS[name](L, R, I, J)
+        if W is None:
+            W = weight * C.astype(np.float64)
+        else:
+            W += weight * C
+    return W
+
+
+def vcost_rosname(L, R, I, J):
+    I, J = np.broadcast_arrays(I, J)
+    C = np.where(L.rosname[I] == R.rosname[J], 0, 3)
+    # slow path: wildcard rosnames have to be matched one by one
+    for k in zip(*np.nonzero(L.wildcard[I] & (C != 0))):
+        i = I[k]
+        j = J[k]
+        pattern = L.patterns[i]
+        m = pattern.match(R.expected[j])
+        if not m and R.alt[j]:
+            m = pattern.match(R.alt[j])
+        if m:
+            C[k] = 2 if L.multi_wildcard[i] else 1
+    return C
+
+def vcost_rostype(L, R, I, J):
+    return (L.rostype[I] != R.rostype[J]).astype(np.int64)
+
+def vcost_traceability(L, R, I, J):
+    assert not R.has_unknown_traceability()
+    return np.select((
+        L.package[I] != R.package[J],
+        L.file[I] != R.file[J],
+        ~(L.line[I] == R.line[J]),
+        ~(L.column[I] == R.column[J]),
+    ), (4, 3, 2, 1), default=0)
+
+def vcost_traceability_main(L, R, I, J):
+    assert not R.has_unknown_traceability()
+    p_line = L.line[I]
+    p_col = L.column[I]
+    d_line = np.floor(np.abs(R.line[J] - p_line))
+    d_col = np.floor(np.abs(R.column[J] - p_col))
+    return np.select((
+        L.package[I] != R.package[J],
+        L.file[I] != R.file[J],
+        np.isnan(p_line) | np.isnan(p_col),
+        (d_line == 1) & (d_col == 0),
+        d_line == 1,
+        d_line > 0,
+        (d_col > 0) & (d_col <= 8),
+        (d_col > 0) & (d_col < 50),
+        d_col > 0,
+    ), (8, 4, 3, 1, 2, 3, 1, 2, 3), default=0)
+
+
+COMPONENT_FUNCTIONS = {
+    "rosname": vcost_rosname,
+    "rostype": vcost_rostype,
+    "traceability": vcost_traceability,
+    "traceability_main": vcost_traceability_main,
+}
+
+# Each cost function as a weighted sum of vectorized components.
+COST_COMPONENTS = {
+    cost_rosname: ((1, "rosname"),),
+    cost_rostype: ((1, "rostype"),),
+    cost_rosname_rostype: ((2, "rosname"), (1, "rostype")),
+    cost_traceability: ((1, "traceability"),),
+    cost_rosname_rostype_traceability: (
+        (2 * 5, "rosname"), (5, "rostype"), (1, "traceability")),
+    cost_traceability_main: ((1, "traceability_main"),),
+    cost_traceability_rosname: ((4, "traceability_main"), (1, "rosname")),
+    cost_traceability_rosname_rostype: (
+        (4 * 2, "traceability_main"), (2, "rosname"), (1, "rostype")),
+}
+
+# Cost functions led by rosname, whose other components never break the
+# triangle inequality, so that `_exact_pairs` can be matched up front.
+# With location first, a pair one line apart costs less than a pair of
+# different rosnames, but two such steps may cost more than a direct pair.
+EXACT_JOIN_COSTS = frozenset((cost_rosname, cost_rosname_rostype,
+                              cost_rosname_rostype_traceability))
+
+
+def blocked_pairs(components, L, R, t):
+    # Pairs whose blocking keys differ cost at least `w * k` for one of the
+    # components, where `k` is the minimum cost of that component for
+    # different keys. If that reaches the threshold, only pairs that share
+    # a key (plus the rows that match any key) have to be compared.
+    for weight, name in components:
+        blocking = BLOCKING_KEYS.get(name)
+        if blocking is not None and weight * blocking[0] >= t:
+            lhs_keys, rhs_keys, free = blocking[1](L, R)
+            return _hash_join(lhs_keys, rhs_keys, free)
+    I, J = np.indices((L.size, R.size))
+    return I.ravel(), J.ravel()
+
+def _rosname_keys(L, R):
+    # wildcard rosnames may match anything
+    return L.rosname, R.rosname, L.wildcard
+
+def _location_keys(L, R):
+    # unknown package or file (-1) never equals a ground truth key
+    n = max(L.file.max(), R.file.max()) + 2
+    return (L.package * n + L.file, R.package * n + R.file,
+            np.zeros(L.size, dtype=bool))
+
+# component -> (minimum cost for different keys, key function)
+BLOCKING_KEYS = {
+    "rosname": (3, _rosname_keys),
+    "traceability_main": (4, _location_keys),
+}
+
+def _hash_join(lhs_keys, rhs_keys, free):
+    order = np.argsort(rhs_keys, kind="mergesort")
+    sorted_keys = rhs_keys[order]
+    lo = np.searchsorted(sorted_keys, lhs_keys, side="left")
+    hi = np.searchsorted(sorted_keys, lhs_keys, side="right")
+    counts = hi - lo
+    counts[free] = 0
+    total = counts.sum()
+    I = np.repeat(np.arange(lhs_keys.size), counts)
+    starts = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+    J = order[starts + np.arange(total)]
+    free_rows = np.flatnonzero(free)
+    if free_rows.size:
+        m = rhs_keys.size
+        I = np.concatenate((I, np.repeat(free_rows, m)))
+        J = np.concatenate((J, np.tile(np.arange(m), free_rows.size)))
+    return I, J
+
+
+def _encode(values, vocab):
+    # None is reserved code -1, so that it never equals a known value.
+    # Codes come from a global counter, so that concurrent threads never
+    # assign the same code to different values of a shared vocabulary.
+    codes = np.empty(len(values), dtype=np.int64)
+    for i, value in enumerate(values):
+        if value is None:
+            codes[i] = -1
+        else:
+            code = vocab.get(value)
+            if code is None:
+                code = vocab.setdefault(value, next(_next_code))
+            codes[i] = code
+    return codes
+
+_next_code = count()
+
+def _encode_numbers(values):
+    return np.array([np.nan if x is None else x for x in values],
+                    dtype=np.float64)
+
+
+###############################################################################
+# Multi-Strategy Matching
+###############################################################################
+
+# strategy name -> (cost function, threshold)
+STRATEGIES = {
+    "name": (cost_rosname, 3),
+    "name_type": (cost_rosname_rostype, 2*3),
+    "name_type_loc": (cost_rosname_rostype_traceability, 5*2*3),
+    "loc": (cost_traceability_main, 4),
+    "loc_name": (cost_traceability_rosname, 4*4),
+    "loc_name_type": (cost_traceability_rosname_rostype, 4*2*4),
+}
+
+# component -> equivalent scalar cost function
+SCALAR_COMPONENTS = {
+    "rosname": cost_rosname,
+    "rostype": cost_rostype,
+    "traceability": cost_traceability,
+    "traceability_main": cost_traceability_main,
+}
+
+
+class StrategyMatcher(object):
+    # Converts the model and the ground truth once, and caches every
+    # component cost matrix, so that several strategies (weighted sums of
+    # the same components) can be compared at a fraction of the cost.
+    # Entity lists are identified by `id()`; the matcher keeps a reference
+    # to every list in its caches, so that their ids are not reused.
+    # Problems are solved as in `matching_by`, with the same `options` and
+    # the same exact-pair prepass, so the results are the same. Problems
+    # for the sparse or the approximate solver do not use a cost matrix,
+    # and are solved as usual, without sharing anything. Link problems are
+    # always solved in this process, regardless of `options.workers`.
+    __slots__ = ("nodes", "parameters", "options", "_tables", "_costs")
+
+    def __init__(self, config, truth, options=DEFAULT_OPTIONS):
+        model = convert_model(config)
+        truth = convert_truth(truth)
+        self.nodes = (model.nodes, truth.nodes)
+        self.parameters = (model.parameters, truth.parameters)
+        self.options = options
+        self._tables = {}
+        self._costs = {}
+
+    def match(self, strategy):
+        cost_function, t = STRATEGIES[strategy]
+        return self.match_by(cost_function, t)
+
+    def match_by(self, cost_function, t=INF):
+        options = self.options
+        if options.solver == "approx" and options.approx is None:
+            # the time budget is for each strategy
+            options = options.replace(approx=ApproxRecorder(
+                options.time_budget))
+        _approx_resource(options, "nodes")
+        M_nodes = self._matching(self.nodes[0], self.nodes[1],
+                                 cost_function, t, options)
+        _approx_resource(options, "parameters")
+        M_params = self._matching(self.parameters[0], self.parameters[1],
+                                  cost_function, t, options)
+        links = [self._link_matching(M_nodes, attr, cost_function, t,
+                                     options)
+                 for attr in LINK_ATTRS]
+        return GraphData(M_nodes, M_params, *links)
+
+    def cost_matrix(self, lhs, rhs, cost_function):
+        components = COST_COMPONENTS.get(cost_function)
+        if components is None:
+            return self._cost(lhs, rhs, cost_function)
+        W = None
+        for weight, name in components:
+            C = self._cost(lhs, rhs, name)
+            if W is None:
+                W = weight * C.astype(np.float64)
+            else:
+                W += weight * C
+        return W
+
+    def _link_matching(self, M_nodes, attr, cost_function, t, options):
+        _approx_resource(options, attr)
+        M = Matching([], [], [])
+        for node in M_nodes.missing:
+            M.missing.extend(getattr(node, attr))
+        for node in M_nodes.spurious:
+            M.spurious.extend(getattr(node, attr))
+        for node, gold in M_nodes.matches:
+            m = self._matching(getattr(node, attr), getattr(gold, attr),
+                               cost_function, t, options)
+            M.matches.extend(m.matches)
+            M.missing.extend(m.missing)
+            M.spurious.extend(m.spurious)
+        return M
+
+    def _matching(self, lhs, rhs, cost_function, t, options):
+        # same as `_matching` and `_assignment`
+        if (not lhs or not rhs or _use_sparse_solver(lhs, rhs, options)
+                or (options.solver == "approx"
+                    and len(lhs) * len(rhs) >= options.approx_min_size)):
+            return _matching(lhs, rhs, cost_function, t, options)
+        cache = _match_cache(options, cost_function)
+        if cache is None:
+            rows, cols = self._solve(lhs, rhs, cost_function, t, options)
+        else:
+            key = cache.problem_key(lhs, rhs, cost_function, t,
+                                    options.solver)
+            solution = cache.get(key)
+            if solution is None:
+                solution = self._solve(lhs, rhs, cost_function, t, options)
+                cache.put(key, *solution)
+            rows, cols = solution
+        return _build_matching(lhs, rhs, rows, cols)
+
+    def _solve(self, lhs, rhs, cost_function, t, options):
+        # same as `_solve`, on the cached cost matrix
+        W = self.cost_matrix(lhs, rhs, cost_function)
+        pairs = ()
+        if cost_function in EXACT_JOIN_COSTS:
+            pairs = _exact_pairs(lhs, rhs, cost_function)
+        if not pairs:
+            return self._solve_residual(W, lhs, rhs, cost_function, t,
+                                        options)
+        joined_lhs = set(i for i, j in pairs)
+        joined_rhs = set(j for i, j in pairs)
+        rest_lhs = [i for i in range(len(lhs)) if i not in joined_lhs]
+        rest_rhs = [j for j in range(len(rhs)) if j not in joined_rhs]
+        rows = [i for i, j in pairs]
+        cols = [j for i, j in pairs]
+        if rest_lhs and rest_rhs:
+            sub_rows, sub_cols = self._solve_residual(
+                W[np.ix_(rest_lhs, rest_rhs)], [lhs[i] for i in rest_lhs],
+                [rhs[j] for j in rest_rhs], cost_function, t, options)
+            rows.extend(rest_lhs[i] for i in sub_rows.tolist())
+            cols.extend(rest_rhs[j] for j in sub_cols.tolist())
+        return (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp))
+
+    def _solve_residual(self, W, lhs, rhs, cost_function, t, options):
+        solve = capped_assignment
+        cache = _match_cache(options, cost_function)
+        if cache is not None:
+            solve = cache.block_solver(lhs, rhs, cost_function, t, solve)
+        return threshold_assignment(W, t, solve=solve)
+
+    def _cost(self, lhs, rhs, component):
+        # `component` is a component name or a custom cost function
+        key = (component, id(lhs), id(rhs))
+        entry = self._costs.get(key)
+        if entry is not None:
+            return entry[0]
+        if component not in COMPONENT_FUNCTIONS:
+            C = _cost_matrix(lhs, rhs, component)
+        elif len(lhs) * len(rhs) < VECTORIZE_MIN_SIZE:
+            C = _cost_matrix(lhs, rhs, SCALAR_COMPONENTS[component])
+            C = C.astype(np.int8)
+        else:
+            L = self._table(lhs)
+            R = self._table(rhs)
+            I = np.arange(L.size)[:, np.newaxis]
+            J = np.arange(R.size)[np.newaxis, :]
+            C = COMPONENT_FUNCTIONS[component](L, R, I, J).astype(np.int8)
+        self._costs[key] = (C, lhs, rhs)
+        return C
+
+    def _table(self, entities):
+        entry = self._tables.get(id(entities))
+        if entry is None:
+            entry = (EntityTable(entities), entities)
+            self._tables[id(entities)] = entry
+        return entry[0]
+
+
+###############################################################################
+# Entity Store
+###############################################################################
+
+# Converted entities share their strings, locations and guards, which repeat
+# all over a model (package names, file paths, message types, `if` blocks).
+# Interned values live for the whole HAROS run, since configurations of the
+# same project share most of them; `clear_entity_store()` releases them,
+# along with the string codes and compiled ROS name patterns.
+
+# string -> integer code, shared by every `EntityTable`
+STRING_CODES = {}
+
+_strings = {}
+_locations = {}
+_guards = {}
+_condition_trees = {}
+
+UNKNOWN_LOCATION = Location(None, None, None, None)
+
+EMPTY_CONDITIONS = ConditionTree({})
+
+
+def intern_string(s):
+    if s is None:
+        return None
+    return _strings.setdefault(s, s)
+
+def new_location(package, file, line, column):
+    # plain tuples find equal named tuples, no need to build a Location
+    loc = _locations.get((package, file, line, column))
+    if loc is None:
+        loc = Location(intern_string(package), intern_string(file),
+                       line, column)
+        loc = _locations.setdefault(loc, loc)
+    return loc
+
+def new_guard(package, file, line, column, statement):
+    g = _guards.get((package, file, line, column, statement))
+    if g is None:
+        g = Guard(intern_string(package), intern_string(file), line, column,
+                  intern_string(statement))
+        g = _guards.setdefault(g, g)
+    return g
+
+def new_condition_tree(children):
+    # `children` maps guards to condition trees; it is owned by the tree.
+    if not children:
+        return EMPTY_CONDITIONS
+    tree = ConditionTree(children)
+    other = _condition_trees.setdefault(tree.digest, tree)
+    if other is not tree and other._children == children:
+        return other
+    return tree # new tree, or a hash collision, which only costs sharing
+
+def clear_entity_store():
+    # Existing entities remain valid; they just stop sharing new values.
+    # Existing entity tables remain valid too, but they must not be compared
+    # with tables built afterwards, which get new codes for the same strings.
+    # `_next_code` keeps counting, so that old codes are never reused.
+    _strings.clear()
+    _locations.clear()
+    _guards.clear()
+    _condition_trees.clear()
+    STRING_CODES.clear()
+    _rosname_patterns.clear()
+
+
 ###############################################################################
 # HAROS Conversion Functions
 ###############################################################################
 
+def convert_model(config):
+    # `config` is a HAROS Configuration, or a ModelData
+    if isinstance(config, ModelData):
+        return config
+    return ModelData(_haros_nodes(config.nodes.enabled),
+                     _haros_params(config.parameters.enabled))
+
 def convert_haros_node(node):
     if node._location:
         traceability = convert_haros_location(node._location)
@@ -332,7 +1259,8 @@ def convert_haros_node(node):
     servers = [convert_haros_srv(link) for link in node.servers]
     setters = [convert_haros_setter(link) for link in node.writes]
     getters = [convert_haros_getter(link) for link in node.reads]
-    return NodeAttrs(id(node), node.id, node.type, traceability, node.argv,
+    return NodeAttrs(id(node), intern_string(node.id),
+        intern_string(node.type), traceability, node.argv,
         node.remaps, conditions, pubs, subs, clients, servers, setters, getters)
 
 def convert_haros_param(param):
@@ -342,8 +1270,8 @@ def convert_haros_param(param):
     else:
         traceability = convert_haros_location2(param.location2)
     conditions = convert_haros_conditions(param.conditions)
-    return ParamAttrs(id(param), param.id, param.type, traceability,
-        param.value, conditions)
+    return ParamAttrs(id(param), intern_string(param.id),
+        intern_string(param.type), traceability, param.value, conditions)
 
 def convert_haros_pub(link):
     if link.source_location:
@@ -351,8 +1279,9 @@ def convert_haros_pub(link):
     else:
         traceability = convert_haros_location2(link.location2)
     conditions = convert_haros_conditions(link.conditions)
-    return PubAttrs(id(link), link.topic.id, link.type,
-        traceability, link.rosname.full, link.queue_size, link.latched,
+    return PubAttrs(id(link), intern_string(link.topic.id),
+        intern_string(link.type), traceability,
+        intern_string(link.rosname.full), link.queue_size, link.latched,
         conditions)
 
 def convert_haros_sub(link):
@@ -361,8 +1290,9 @@ def convert_haros_sub(link):
     else:
         traceability = convert_haros_location2(link.location2)
     conditions = convert_haros_conditions(link.conditions)
-    return SubAttrs(id(link), link.topic.id, link.type,
-        traceability, link.rosname.full, link.queue_size, conditions)
+    return SubAttrs(id(link), intern_string(link.topic.id),
+        intern_string(link.type), traceability,
+        intern_string(link.rosname.full), link.queue_size, conditions)
 
 def convert_haros_cli(link):
     if link.source_location:
@@ -370,8 +1300,9 @@ def convert_haros_cli(link):
     else:
         traceability = convert_haros_location2(link.location2)
     conditions = convert_haros_conditions(link.conditions)
-    return CliAttrs(id(link), link.service.id, link.type,
-        traceability, link.rosname.full, conditions)
+    return CliAttrs(id(link), intern_string(link.service.id),
+        intern_string(link.type), traceability,
+        intern_string(link.rosname.full), conditions)
 
 def convert_haros_srv(link):
     if link.source_location:
@@ -379,8 +1310,9 @@ def convert_haros_srv(link):
     else:
         traceability = convert_haros_location2(link.location2)
     conditions = convert_haros_conditions(link.conditions)
-    return SrvAttrs(id(link), link.service.id, link.type,
-        traceability, link.rosname.full, conditions)
+    return SrvAttrs(id(link), intern_string(link.service.id),
+        intern_string(link.type), traceability,
+        intern_string(link.rosname.full), conditions)
 
 def convert_haros_setter(link):
     if link.source_location:
@@ -388,8 +1320,9 @@ def convert_haros_setter(link):
     else:
         traceability = convert_haros_location2(link.location2)
     conditions = convert_haros_conditions(link.conditions)
-    return SetAttrs(id(link), link.parameter.id, link.type,
-        traceability, link.rosname.full, link.value, conditions)
+    return SetAttrs(id(link), intern_string(link.parameter.id),
+        intern_string(link.type), traceability,
+        intern_string(link.rosname.full), link.value, conditions)
 
 def convert_haros_getter(link):
     if link.source_location:
@@ -397,38 +1330,45 @@ def convert_haros_getter(link):
     else:
         traceability = convert_haros_location2(link.location2)
     conditions = convert_haros_conditions(link.conditions)
-    return GetAttrs(id(link), link.parameter.id, link.type,
-        traceability, link.rosname.full, link.value, conditions)
+    return GetAttrs(id(link), intern_string(link.parameter.id),
+        intern_string(link.type), traceability,
+        intern_string(link.rosname.full), link.value, conditions)
 
 
 def convert_haros_location(loc):
     if loc is None or loc.package is None:
-        return Location(None, None, None, None)
+        return UNKNOWN_LOCATION
     if loc.file is None:
-        return Location(loc.package.name, None, None, None)
-    return Location(loc.package.name, loc.file.full_name, loc.line, loc.column)
+        return new_location(loc.package.name, None, None, None)
+    return new_location(loc.package.name, loc.file.full_name, loc.line,
+                        loc.column)
 
 def convert_haros_location2(loc2):
-    return Location(loc2.package, loc2.file, loc2.line, loc2.column)
+    return new_location(loc2.package, loc2.file, loc2.line, loc2.column)
 
 def convert_haros_conditions(conditions):
-    cfg = {}
-    cur = cfg
-    for condition in conditions:
+    # a single path, built from the innermost condition up
+    cfg = EMPTY_CONDITIONS
+    for condition in reversed(conditions):
         loc = convert_haros_location(condition.location)
-        g = Guard(loc.package, loc.file, loc.line, loc.column,
-                  condition.statement)
-        new_cfg = {}
-        cur[g] = new_cfg
-        cur = new_cfg
+        g = new_guard(loc.package, loc.file, loc.line, loc.column,
+                      condition.statement)
+        cfg = new_condition_tree({g: cfg})
     return cfg
 
 ###############################################################################
 # Ground Truth Conversion Functions
 ###############################################################################
 
+def convert_truth(truth):
+    if isinstance(truth, TruthData):
+        return truth
+    return TruthData(_truth_nodes(truth.get("nodes", {})),
+                     _truth_params(truth.get("parameters", {})))
+
 def convert_truth_node(rosname, data):
-    rostype = data["node_type"]
+    rosname = intern_string(rosname)
+    rostype = intern_string(data["node_type"])
     traceability = convert_truth_traceability(data["traceability"])
     args = data.get("args", "")
     remaps = data.get("remaps", {})
@@ -443,7 +1383,8 @@ def convert_truth_node(rosname, data):
         conditions, pubs, subs, clients, servers, setters, getters)
 
 def convert_truth_params(rosname, data):
-    rostype = data.get("param_type")
+    rosname = intern_string(rosname)
+    rostype = intern_string(data.get("param_type"))
     traceability = convert_truth_traceability(data["traceability"])
     value = data.get("default_value")
     conditions = convert_truth_conditions(data.get("conditions", ()))
@@ -454,10 +1395,10 @@ def convert_truth_params(rosname, data):
             conditions),)
 
 def convert_truth_pub(link):
-    rosname = link["topic"]
-    rostype = link["msg_type"]
+    rosname = intern_string(link["topic"])
+    rostype = intern_string(link["msg_type"])
     traceability = convert_truth_traceability(link["traceability"])
-    original_name = link.get("original_name", rosname)
+    original_name = intern_string(link.get("original_name", rosname))
     queue_size = link["queue_size"]
     latched = link.get("latched", False)
     conditions = convert_truth_conditions(link.get("conditions", ()))
@@ -465,48 +1406,48 @@ def convert_truth_pub(link):
         original_name, queue_size, latched, conditions)
 
 def convert_truth_sub(link):
-    rosname = link["topic"]
-    rostype = link["msg_type"]
+    rosname = intern_string(link["topic"])
+    rostype = intern_string(link["msg_type"])
     traceability = convert_truth_traceability(link["traceability"])
-    original_name = link.get("original_name", rosname)
+    original_name = intern_string(link.get("original_name", rosname))
     queue_size = link["queue_size"]
     conditions = convert_truth_conditions(link.get("conditions", ()))
     return SubAttrs(id(link), rosname, rostype, traceability,
         original_name, queue_size, conditions)
 
 def convert_truth_cli(link):
-    rosname = link["service"]
-    rostype = link["srv_type"]
+    rosname = intern_string(link["service"])
+    rostype = intern_string(link["srv_type"])
     traceability = convert_truth_traceability(link["traceability"])
-    original_name = link.get("original_name", rosname)
+    original_name = intern_string(link.get("original_name", rosname))
     conditions = convert_truth_conditions(link.get("conditions", ()))
     return CliAttrs(id(link), rosname, rostype, traceability,
         original_name, conditions)
 
 def convert_truth_srv(link):
-    rosname = link["service"]
-    rostype = link["srv_type"]
+    rosname = intern_string(link["service"])
+    rostype = intern_string(link["srv_type"])
     traceability = convert_truth_traceability(link["traceability"])
-    original_name = link.get("original_name", rosname)
+    original_name = intern_string(link.get("original_name", rosname))
     conditions = convert_truth_conditions(link.get("conditions", ()))
     return SrvAttrs(id(link), rosname, rostype, traceability,
         original_name, conditions)
 
 def convert_truth_setter(link):
-    rosname = link["parameter"]
-    rostype = link["param_type"]
+    rosname = intern_string(link["parameter"])
+    rostype = intern_string(link["param_type"])
     traceability = convert_truth_traceability(link["traceability"])
-    original_name = link.get("original_name", rosname)
+    original_name = intern_string(link.get("original_name", rosname))
     value = link.get("value")
     conditions = convert_truth_conditions(link.get("conditions", ()))
     return SetAttrs(id(link), rosname, rostype, traceability,
         original_name, value, conditions)
 
 def convert_truth_getter(link):
-    rosname = link["parameter"]
-    rostype = link["param_type"]
+    rosname = intern_string(link["parameter"])
+    rostype = intern_string(link["param_type"])
     traceability = convert_truth_traceability(link["traceability"])
-    original_name = link.get("original_name", rosname)
+    original_name = intern_string(link.get("original_name", rosname))
     value = link.get("default_value")
     conditions = convert_truth_conditions(link.get("conditions", ()))
     return GetAttrs(id(link), rosname, rostype, traceability,
@@ -515,8 +1456,8 @@ def convert_truth_getter(link):
 
 def convert_truth_traceability(traceability):
     if traceability is None:
-        return Location(None, None, None, None)
-    return Location(traceability["package"], traceability["file"],
+        return UNKNOWN_LOCATION
+    return new_location(traceability["package"], traceability["file"],
         traceability["line"], traceability["column"])
 
 def convert_truth_conditions(paths):
@@ -524,20 +1465,41 @@ def convert_truth_conditions(paths):
     for path in paths:
         r = cfg
         for c in path:
-            g = Guard(c["package"], c["file"], c["line"], c["column"],
-                      c["statement"])
+            g = new_guard(c["package"], c["file"], c["line"], c["column"],
+                          c["statement"])
             s = r.get(g)
             if s is None:
                 s = {}
                 r[g] = s
             r = s
-    return cfg
+    return freeze_conditions(cfg)
+
+def freeze_conditions(cfg):
+    # nested dicts -> ConditionTree
+    return new_condition_tree({g: freeze_conditions(child)
+                               for g, child in cfg.items()})
 
 ###############################################################################
 # Helper Functions
 ###############################################################################
 
 def rosname_match(rosname, expected, alt=None):
+    pattern = rosname_pattern(rosname)
+    m = pattern.match(expected)
+    if not m and alt:
+        return pattern.match(alt)
+    return m
+
+def rosname_pattern(rosname):
+    pattern = _rosname_patterns.get(rosname)
+    if pattern is None:
+        pattern = re.compile(_rosname_regex(rosname))
+        _rosname_patterns[rosname] = pattern
+    return pattern
+
+_rosname_patterns = {}
+
+def _rosname_regex(rosname):
     parts = []
     prev = "/"
     n = len(rosname)
@@ -566,28 +1528,25 @@ def rosname_match(rosname, expected, alt=None):
     if i < n:
         parts.append(rosname[i:])
     parts.append("$")
-    pattern = "".join(parts)
-    m = re.match(pattern, expected)
-    if not m and alt:
-        return re.match(pattern, alt)
-    return m
+    return "".join(parts)
 
 
 def _unfold_yaml(rosname, traceability, conditions, data):
     assert isinstance(data, dict) and len(data) > 0
-    flog("unfold yaml for {!r}: {}".format(rosname, data))
+    log = flog
+    log("unfold yaml for {!r}: {}", rosname, data)
     params = []
     stack = [("", rosname, data)]
     while stack:
         ns, key, value = stack.pop()
         name = _ns_join(key, ns)
         if not isinstance(value, dict):
-            flog("create inner param {!r}: {!r}".format(name, value))
+            log("create inner param {!r}: {!r}", name, value)
             params.append(ParamAttrs(name, name,
                 _param_type(value), traceability, value, conditions))
         else:
             for key, other in value.items():
-                flog("delegate yaml param (ns={!r}, name={!r})".format(name, key))
+                log("delegate yaml param (ns={!r}, name={!r})", name, key)
                 stack.append((name, key, other))
     return params
 
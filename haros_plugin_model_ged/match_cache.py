@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+#Copyright (c) 2020 André Santos
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in
+#all copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#THE SOFTWARE.
+
+
+###############################################################################
+# Notes
+###############################################################################
+
+# Persistent cache of assignment solutions, keyed by the content of the
+# entities involved, so that consecutive runs only solve the assignment
+# problems (or the independent blocks of a problem) that changed.
+#
+# A key covers the cost function, the threshold, the solver, and the ordered
+# sequence of content hashes of both sides. Same key means same cost matrix,
+# with rows and columns in the same order, hence the same solution that a
+# full recomputation would produce.
+# Entity `key` fields hold object ids, so they are not part of the content.
+#
+# The cost function is identified by its module and qualified name, which
+# must lead back to the function itself. Lambdas, nested functions, partials
+# and callable objects have no such name, and their problems are not cached,
+# since a name like `<lambda>` would mix up the solutions of different costs.
+
+
+###############################################################################
+# Imports
+###############################################################################
+
+from builtins import object
+import hashlib
+import io
+import json
+import os
+import sys
+
+import numpy as np
+
+from .graph_matching import ConditionTree
+
+
+###############################################################################
+# Match Cache
+###############################################################################
+
+class MatchCache(object):
+    VERSION = 2
+
+    __slots__ = ("path", "_entries", "_used", "_hashes")
+
+    def __init__(self, path=None):
+        self.path = path
+        self._entries = {}  # previous runs
+        self._used = {}     # this run
+        self._hashes = {}   # id(entity) -> (entity, hash)
+
+    def __getstate__(self):
+        # entity ids are only valid in this process
+        return (self.path, self._entries, self._used)
+
+    def __setstate__(self, state):
+        self.path, self._entries, self._used = state
+        self._hashes = {}
+
+    @classmethod
+    def load(cls, path):
+        cache = cls(path)
+        if os.path.isfile(path):
+            with io.open(path, "r", encoding="utf-8") as f:
+                try:
+                    data = json.load(f)
+                except ValueError:
+                    data = None
+            if isinstance(data, dict) and data.get("version") == cls.VERSION:
+                cache._entries = data.get("entries", {})
+        return cache
+
+    def save(self, path=None):
+        # only the entries used in this run are kept
+        path = path or self.path
+        data = {"version": self.VERSION, "entries": self._used}
+        with io.open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(data, separators=(",", ":")))
+
+    @property
+    def hits(self):
+        return sum(1 for key in self._used if key in self._entries)
+
+    def __len__(self):
+        return len(self._used)
+
+    def get(self, key):
+        pairs = self._used.get(key)
+        if pairs is None:
+            pairs = self._entries.get(key)
+            if pairs is None:
+                return None
+            self._used[key] = pairs
+        return (np.array(pairs[0], dtype=np.intp),
+                np.array(pairs[1], dtype=np.intp))
+
+    def put(self, key, rows, cols):
+        self._used[key] = [[int(i) for i in rows], [int(j) for j in cols]]
+
+    def accepts(self, cost_function):
+        return cost_function_name(cost_function) is not None
+
+    def problem_key(self, lhs, rhs, cost_function, t, solver):
+        return self._key("problem", cost_function, t, solver,
+                         (self.content_hash(u) for u in lhs),
+                         (self.content_hash(v) for v in rhs))
+
+    def block_solver(self, lhs, rhs, cost_function, t, solve):
+        # Wraps a block solver `solve(W, t, rows, cols)`, for the blocks
+        # of an assignment problem between `lhs` and `rhs`.
+        def cached_solve(W, t, rows, cols):
+            key = self._key("block", cost_function, t, "dense",
+                            (self.content_hash(lhs[i]) for i in rows),
+                            (self.content_hash(rhs[j]) for j in cols))
+            result = self.get(key)
+            if result is None:
+                result = solve(W, t, rows, cols)
+                self.put(key, result[0], result[1])
+            return result
+        return cached_solve
+
+    def content_hash(self, entity):
+        entry = self._hashes.get(id(entity))
+        if entry is None:
+            h = hashlib.sha1()
+            h.update(type(entity).__name__.encode("utf-8"))
+            for value in entity[1:]:
+                h.update(self._canonical(value).encode("utf-8"))
+            entry = (entity, h.hexdigest())
+            self._hashes[id(entity)] = entry
+        return entry[1]
+
+    def _key(self, kind, cost_function, t, solver, lhs_hashes, rhs_hashes):
+        h = hashlib.sha1()
+        name = cost_function_name(cost_function)
+        if name is None:
+            raise ValueError("cannot cache an anonymous cost function: "
+                             + repr(cost_function))
+        h.update("{}:{}:{}:{!r}:{}".format(kind, self.VERSION, name,
+            t, solver).encode("utf-8"))
+        for digest in lhs_hashes:
+            h.update(digest.encode("utf-8"))
+        h.update(b"|")
+        for digest in rhs_hashes:
+            h.update(digest.encode("utf-8"))
+        return h.hexdigest()
+
+    def _canonical(self, value):
+        # nested entities (e.g., the links of a node) are hashed on their own
+        fields = getattr(value, "_fields", None)
+        if isinstance(value, tuple) and fields and fields[0] == "key":
+            return "#" + self.content_hash(value)
+        if isinstance(value, (list, tuple)):
+            return "[{}]".format(",".join(self._canonical(x) for x in value))
+        if isinstance(value, (dict, ConditionTree)):
+            items = sorted((self._canonical(k), self._canonical(v))
+                           for k, v in value.items())
+            return "{{{}}}".format(",".join(k + ":" + v for k, v in items))
+        return "{}:{!r}".format(type(value).__name__, value)
+
+
+def cost_function_name(cost_function):
+    # Returns "module:qualified.name", or None if that name does not lead
+    # back to `cost_function` (see the notes above).
+    module = getattr(cost_function, "__module__", None)
+    name = getattr(cost_function, "__qualname__", None)
+    if name is None:
+        name = getattr(cost_function, "__name__", None)
+    if not module or not name or "<" in name:
+        return None
+    obj = sys.modules.get(module)
+    for attr in name.split("."):
+        obj = getattr(obj, attr, None)
+    if obj is not cost_function:
+        return None
+    return "{}:{}".format(module, name)
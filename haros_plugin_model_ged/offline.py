@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+
+#Copyright (c) 2020 André Santos
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in
+#all copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#THE SOFTWARE.
+
+
+
+###############################################################################
+# Notes
+###############################################################################
+
+# Offline evaluation, without HAROS.
+#
+#   python -m haros_plugin_model_ged.offline eval MODEL TRUTH [options]
+#       Evaluates a model snapshot, exported by the plugin with the
+#       `model_snapshot` option, against a ground truth file (YAML, JSON or
+#       MessagePack, without imports), and writes the same files as the
+#       plugin, plus the HTML report, optionally under a profiler.
+#
+#   python -m haros_plugin_model_ged.offline export --synthetic N [options]
+#       Writes a model snapshot and a JSON ground truth for a synthetic
+#       model of N nodes (see the `benchmark` module).
+
+
+###############################################################################
+# Imports
+###############################################################################
+
+from __future__ import print_function
+from collections import namedtuple
+import argparse
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+from timeit import default_timer as timer
+
+from .benchmark import DEFAULT_SPEC, SyntheticSpec, synthetic_config
+from .graph_diff import calc_performance, DEFAULT_MAX_DIFFS, DIFF_MODES
+from .graph_matching import convert_model, MatchOptions
+from .plugin import (
+    convert_base, hard_coded_nodes, match_options, new_base, new_tracer,
+    output_options_error, update_base, write_report_files, write_trace_file
+)
+from .tracing import span, use_tracer
+from .truth_loader import load_truth_file
+from .truth_snapshot import load_model_snapshot, save_model_snapshot
+
+
+###############################################################################
+# Offline Evaluation
+###############################################################################
+
+# `files` are the names of the files written, starting with the HTML report
+OfflineResult = namedtuple("OfflineResult",
+    ("report", "files", "setup_time", "write_time"))
+
+
+def evaluate(model_path, truth_path, name, attr=None):
+    # `attr` holds the same options as the plugin (`truth` and `import`
+    # are ignored). Files are written to the working directory.
+    attr = attr or {}
+    error = output_options_error(attr)
+    if error is not None:
+        raise ValueError(error)
+    tracer = new_tracer(attr)
+    with use_tracer(tracer):
+        with span("load model snapshot", "setup") as s:
+            model = load_model_snapshot(model_path)
+            s.count(nodes=len(model.nodes), parameters=len(model.parameters))
+        # ---- SETUP PHASE ----------------------------------------------------
+        start_time = timer()
+        with span("setup", "phase"):
+            with span("load truth file", "setup") as s:
+                base = new_base()
+                update_base(base, load_truth_file(truth_path))
+                s.count(nodes=len(base["nodes"]),
+                        parameters=len(base["parameters"]))
+            truth = convert_base(base, attr)
+        setup_time = timer() - start_time
+        # ---- REPORT PHASE ---------------------------------------------------
+        options = match_options(attr, name)
+        report = calc_performance(model, truth, None, options=options,
+            diffs=attr.get("diffs", "all"),
+            max_diffs=attr.get("max_diffs", DEFAULT_MAX_DIFFS))
+        if options.cache is not None:
+            options.cache.save()
+        # ---- OUTPUT PHASE ---------------------------------------------------
+        html, files, write_time = write_report_files(name, attr, report,
+            setup_time, hard_coded_nodes(base))
+    fname = "perf-report-{}.html".format(name)
+    with io.open(fname, "w", encoding="utf-8") as f:
+        f.write(u"<!DOCTYPE html>\n<html>\n<body>\n")
+        f.write(html)
+        f.write(u"\n</body>\n</html>\n")
+    files.insert(0, fname)
+    if tracer is not None:
+        files.append(write_trace_file(name, tracer))
+    return OfflineResult(report, files, setup_time, write_time)
+
+
+def export_synthetic(spec, model_path, truth_path):
+    config, truth = synthetic_config(spec)
+    save_model_snapshot(model_path, convert_model(config))
+    with open(truth_path, "w") as f:
+        json.dump(truth, f)
+
+
+def profiled(f, args, sort="cumulative", limit=30, out=None):
+    # Calls f(*args) under cProfile, and prints the top `limit` functions
+    # to stderr. The full statistics are saved to `out`, if given.
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(f, *args)
+    finally:
+        stats = pstats.Stats(profiler, stream=sys.stderr)
+        stats.sort_stats(sort).print_stats(limit)
+        if out is not None:
+            stats.dump_stats(out)
+
+
+###############################################################################
+# Entry Point
+###############################################################################
+
+EVAL_OPTIONS = ("solver", "workers", "pool", "chunksize", "match_cache",
+                "truth_cache", "time_budget", "diffs", "max_diffs",
+                "diff_page_size", "dump_compression", "trace")
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(prog="haros_plugin_model_ged.offline",
+        description="Evaluate exported model snapshots without HAROS.")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    cmd = commands.add_parser("eval",
+        help="evaluate a model snapshot against a ground truth file")
+    cmd.add_argument("model", help="model snapshot file")
+    cmd.add_argument("truth", help="ground truth file")
+    cmd.add_argument("--name",
+        help="configuration name for output files (default: from MODEL)")
+    cmd.add_argument("--output-dir", default=".",
+        help="directory for the output files")
+    cmd.add_argument("--solver", choices=MatchOptions.SOLVERS)
+    cmd.add_argument("--workers", type=int)
+    cmd.add_argument("--pool", choices=MatchOptions.POOLS)
+    cmd.add_argument("--chunksize", type=int)
+    cmd.add_argument("--match-cache", metavar="DIR")
+    cmd.add_argument("--truth-cache", metavar="DIR")
+    cmd.add_argument("--time-budget", type=float, metavar="SECONDS")
+    cmd.add_argument("--diffs", choices=DIFF_MODES)
+    cmd.add_argument("--max-diffs", type=int)
+    cmd.add_argument("--diff-page-size", type=int)
+    cmd.add_argument("--dump-compression", choices=("gzip", "zstd"))
+    cmd.add_argument("--trace", action="store_true", default=None,
+        help="export a Chrome trace of the evaluation")
+    cmd.add_argument("--profile", action="store_true",
+        help="run under cProfile and print the top functions")
+    cmd.add_argument("--profile-sort", default="cumulative",
+        help="pstats sort key (default: cumulative)")
+    cmd.add_argument("--profile-limit", type=int, default=30)
+    cmd.add_argument("--profile-out", metavar="FILE",
+        help="save the profile statistics, implies --profile")
+
+    cmd = commands.add_parser("export",
+        help="export a synthetic model snapshot and its ground truth")
+    cmd.add_argument("--synthetic", type=int, required=True, metavar="N",
+        help="number of nodes")
+    cmd.add_argument("--links", type=float, default=DEFAULT_SPEC.links)
+    cmd.add_argument("--params", type=float, default=DEFAULT_SPEC.params)
+    cmd.add_argument("--wildcards", type=float,
+        default=DEFAULT_SPEC.wildcards)
+    cmd.add_argument("--perturbation", type=float,
+        default=DEFAULT_SPEC.perturbation)
+    cmd.add_argument("--seed", type=int, default=DEFAULT_SPEC.seed)
+    cmd.add_argument("-o", "--output", default="model-synthetic.snapshot",
+        help="model snapshot file")
+    cmd.add_argument("--truth", default="truth-synthetic.json",
+        help="ground truth file (JSON)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    if args.command == "export":
+        spec = SyntheticSpec(args.synthetic, args.links, args.params,
+                             args.wildcards, args.perturbation, args.seed)
+        export_synthetic(spec, args.output, args.truth)
+        return 0
+    model_path = os.path.abspath(args.model)
+    truth_path = os.path.abspath(args.truth)
+    name = args.name or _snapshot_name(model_path)
+    attr = {option: getattr(args, option) for option in EVAL_OPTIONS
+            if getattr(args, option) is not None}
+    for option in ("match_cache", "truth_cache"):
+        if option in attr:
+            attr[option] = os.path.abspath(attr[option])
+    if args.profile_out is not None:
+        args.profile_out = os.path.abspath(args.profile_out)
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    os.chdir(args.output_dir)
+    call_args = (model_path, truth_path, name, attr)
+    try:
+        if args.profile or args.profile_out is not None:
+            result = profiled(evaluate, call_args, sort=args.profile_sort,
+                              limit=args.profile_limit, out=args.profile_out)
+        else:
+            result = evaluate(*call_args)
+    except (EnvironmentError, ValueError) as e:
+        print("error: {}".format(e), file=sys.stderr)
+        return 1
+    print_result(name, result)
+    return 0
+
+
+def print_result(name, result):
+    report = result.report
+    overall = report.aggregate.overall["*"]
+    print("{}: precision {:.4f}, recall {:.4f}, f1 {:.4f}".format(
+        name, overall.pre, overall.rec, overall.f1))
+    print("graph edit distance: simple {:g}, mid {:g}, full {:g}".format(
+        *report.ged))
+    print("setup {:.3f}s, match {:.3f}s, report {:.3f}s, write {:.3f}s"
+          .format(result.setup_time, report.match_time, report.report_time,
+                  result.write_time))
+    for resource in sorted(report.approximate):
+        bound = report.approximate[resource]
+        print("approximate {}: {} problems, at most {:g} above the optimum{}"
+              .format(resource, bound.problems, bound.gap,
+                      "" if bound.complete else ", time budget exceeded"))
+    for fname in result.files:
+        print(os.path.abspath(fname))
+
+
+def _snapshot_name(path):
+    name = os.path.basename(path)
+    if name.endswith(".snapshot"):
+        name = name[:-len(".snapshot")]
+    if name.startswith("model-"):
+        name = name[len("model-"):]
+    return name
+
+
+if __name__ == "__main__":
+    sys.exit(main())
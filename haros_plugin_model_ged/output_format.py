@@ -26,18 +26,43 @@
 ###############################################################################
 
 from builtins import str
-from builtins import range
-from cgi import escape
+from builtins import range, zip
+import gzip
+import io
+import json
+import os
+try:
+    from html import escape
+except ImportError:
+    from cgi import escape
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .graph_matching import ConditionTree, LINK_ATTRS
+from .tracing import trace_events
 
 ###############################################################################
 # HTML Formatting
 ###############################################################################
 
-def perf_report_html(report, setup_time, hc_nodes):
+# diffs shown in the report itself, the rest go to the diff pages
+INLINE_DIFFS = 20
+
+# diffs per exported page
+DIFF_PAGE_SIZE = 1000
+
+def perf_report_html(report, setup_time, hc_nodes, diff_pages=(),
+                     diff_mode="all"):
+    # `diff_pages` are the files written by `write_html_diffs`
+    # `diff_mode` is the `diffs` option the report was computed with
     parts = []
     parts.append("<p>Setup time: {} seconds</p>".format(setup_time))
     parts.append("<p>Matching time: {} seconds</p>".format(report.match_time))
     parts.append("<p>Report time: {} seconds</p>".format(report.report_time))
+    _perf_report_html_approx(report, parts)
     nr = report.resource.node.metrics["rosname"]
     n = nr.cor + nr.inc + nr.par + nr.mis
     parts.append("<p>Hard-coded nodes: <b>{}</b> out of <b>{}</b></p>".format(
@@ -48,9 +73,32 @@ def perf_report_html(report, setup_time, hc_nodes):
     _html_table(report, parts, "ROS Type", "rostype")
     _html_table(report, parts, "Traceability", "traceability")
     _html_table(report, parts, "Conditions", "conditions")
-    _perf_report_html_diffs(report, parts)
+    _perf_report_html_diffs(report, parts, diff_pages, diff_mode)
     return "\n".join(parts)
 
+def ged_report_html(report):
+    ged = report.ged
+    parts = []
+    parts.append("<p>Minimal data (ROS names): <b>{:g}</b></p>".format(
+        ged.simple))
+    parts.append("<p>Basic data (ROS names and types): <b>{:g}</b></p>"
+        .format(ged.mid))
+    parts.append("<p>All data: <b>{:g}</b></p>".format(ged.full))
+    parts.append("<p>Approximated by the edit path of the matching: "
+        "inserting or deleting a node, parameter or link costs the number "
+        "of its compared attributes, and substituting one costs the number "
+        "of attributes that differ.</p>")
+    return "\n".join(parts)
+
+def _perf_report_html_approx(report, parts):
+    for resource in sorted(report.approximate):
+        b = report.approximate[resource]
+        parts.append("<p>Approximate matching of {}: {} problems, cost {:g}, "
+            "at most {:g} above the optimum{}</p>".format(resource,
+                b.problems, b.cost, b.gap,
+                "" if b.complete else " (time budget exceeded)"))
+
+
 def _html_table(report, parts, header, attr):
     parts.append(HTML_TABLE_TOP.format(attr=header))
     _html_table_row("Overall", report.aggregate.overall[attr], False, parts)
@@ -160,57 +208,281 @@ HTML_TABLE_ROW2 = \
   </tr>"""
 
 
-def _perf_report_html_diffs(report, parts):
-    parts.append("<p>Attribute diffs:")
+RESOURCE_ATTRS = ("node", "parameter", "publisher", "subscriber",
+                  "client", "server", "setter", "getter")
+
+def _perf_report_html_diffs(report, parts, diff_pages, diff_mode):
+    if diff_mode == "none":
+        parts.append("<p>Attribute diffs were not collected (diffs: none)"
+                     "</p>")
+        return
+    found = shown = 0
+    for attr in RESOURCE_ATTRS:
+        r = getattr(report.resource, attr)
+        found += sum(r.diff_counts.values())
+        shown += len(r.diffs)
+    if shown < found:
+        # bounded diff collection, only a sample was kept
+        parts.append("<p>Attribute diffs (kept {} of {}):".format(
+            shown, found))
+        parts.append("<ul>")
+        for attr in RESOURCE_ATTRS:
+            counts = getattr(report.resource, attr).diff_counts
+            if counts:
+                parts.append("<li>{}: {}</li>".format(attr.capitalize(),
+                    ", ".join("{} {}".format(escape(k), counts[k])
+                              for k in sorted(counts))))
+        parts.append("</ul>")
+    else:
+        parts.append("<p>Attribute diffs:")
+    if diff_pages:
+        parts.append("<br>Full list in {}".format(", ".join(
+            '<span class="code">{}</span>'.format(escape(fname))
+            for fname in diff_pages)))
     parts.append("<ul>")
-    for attr in ("node", "parameter", "publisher", "subscriber",
-                 "client", "server", "setter", "getter"):
-        diffs = getattr(report.resource, attr).diffs
-        for diff in diffs:
-            p = diff.p_value
-            g = diff.g_value
-            if diff.attribute == "*":
-                if p is None:
-                    li = ('<li>Missing {} <span class="rosname">{}</span> '
-                          '<br>{}</li>')
-                    s = '<span class="code">{}: {}</span>'
-                    spans = [s.format(g._fields[i], escape(str(g[i])))
-                             for i in range(1, len(g))]
-                    parts.append(li.format(diff.resource_type, diff.rosname,
-                        "<br>".join(spans)))
-                elif g is None:
-                    li = ('<li>Spurious {} <span class="rosname">{}</span> '
-                          '<br>{}</li>')
-                    s = '<span class="code">{}: {}</span>'
-                    spans = [s.format(p._fields[i], escape(str(p[i])))
-                             for i in range(1, len(p))]
-                    parts.append(li.format(diff.resource_type, diff.rosname,
-                        "<br>".join(spans)))
-            else:
-                li = ('<li>{} <span class="rosname">{}</span> '
-                      '[<i>{}:</i> <span class="code">{}</span>'
-                      ' should be <span class="code">{}</span>]</li>')
-                parts.append(li.format(diff.resource_type, diff.rosname,
-                    diff.attribute, escape(str(p)), escape(str(g))))
+    for i, diff in enumerate(_report_diffs(report)):
+        if not diff_pages:
+            parts.append(_html_diff(diff))
+        elif i < INLINE_DIFFS:
+            parts.append(_html_diff(diff, brief=True))
+        else:
+            parts.append("<li>...</li>")
+            break
     parts.append("</ul></p>")
 
 
+def write_html_diffs(prefix, report, page_size=DIFF_PAGE_SIZE):
+    # Writes the diffs of `report` to `<prefix>-<page>.html` files, one diff
+    # at a time, and returns the list of file names.
+    if page_size < 1:
+        raise ValueError("page_size must be positive: {!r}".format(page_size))
+    fnames = []
+    f = None
+    try:
+        for i, diff in enumerate(_report_diffs(report)):
+            if i % page_size == 0:
+                fname = "{}-{}.html".format(prefix, len(fnames) + 1)
+                if f is not None:
+                    _end_diff_page(f, fname)
+                    f.close()
+                f = io.open(fname, "w", encoding="utf-8")
+                _start_diff_page(f, len(fnames) + 1,
+                                 fnames[-1] if fnames else None, i)
+                fnames.append(fname)
+            f.write(str(_html_diff(diff)))
+            f.write(u"\n")
+        if f is not None:
+            _end_diff_page(f, None)
+    finally:
+        if f is not None:
+            f.close()
+    return fnames
+
+def _start_diff_page(f, page, prev_fname, first):
+    f.write(u'<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n')
+    f.write(str("<title>Attribute diffs, page {}</title>\n".format(page)))
+    f.write(str(CSS_STYLE))
+    f.write(u"</head>\n<body>\n")
+    if prev_fname is not None:
+        f.write(str('<p><a href="{}">Previous page</a></p>\n'.format(
+            escape(os.path.basename(prev_fname)))))
+    f.write(str('<ol start="{}">\n'.format(first + 1)))
+
+def _end_diff_page(f, next_fname):
+    f.write(u"</ol>\n")
+    if next_fname is not None:
+        f.write(str('<p><a href="{}">Next page</a></p>\n'.format(
+            escape(os.path.basename(next_fname)))))
+    f.write(u"</body>\n</html>\n")
+
+def _report_diffs(report):
+    for attr in RESOURCE_ATTRS:
+        for diff in getattr(report.resource, attr).diffs:
+            yield diff
+
+def _html_diff(diff, brief=False):
+    # `brief` omits the attributes of missing and spurious entities
+    p = diff.p_value
+    g = diff.g_value
+    resource_type = escape(str(diff.resource_type))
+    rosname = escape(str(diff.rosname))
+    if diff.attribute == "*":
+        if brief:
+            li = '<li>{} {} <span class="rosname">{}</span></li>'
+            return li.format("Missing" if p is None else "Spurious",
+                resource_type, rosname)
+        if p is None:
+            li = ('<li>Missing {} <span class="rosname">{}</span> '
+                  '<br>{}</li>')
+            s = '<span class="code">{}: {}</span>'
+            spans = [s.format(escape(g._fields[i]), escape(str(g[i])))
+                     for i in range(1, len(g))]
+            return li.format(resource_type, rosname, "<br>".join(spans))
+        li = ('<li>Spurious {} <span class="rosname">{}</span> '
+              '<br>{}</li>')
+        s = '<span class="code">{}: {}</span>'
+        spans = [s.format(escape(p._fields[i]), escape(str(p[i])))
+                 for i in range(1, len(p))]
+        return li.format(resource_type, rosname, "<br>".join(spans))
+    li = ('<li>{} <span class="rosname">{}</span> '
+          '[<i>{}:</i> <span class="code">{}</span>'
+          ' should be <span class="code">{}</span>]</li>')
+    return li.format(resource_type, rosname, escape(str(diff.attribute)),
+        escape(str(p)), escape(str(g)))
+
+
 ###############################################################################
 # Text Formatting
 ###############################################################################
 
-def write_txt(fname, truth, report):
-    parts = []
-    parts.append("-------- PARAMS --------")
-    for rosname, data in truth.get("parameters", {}).items():
-        parts.append("{!r} {}".format(rosname, data))
-    parts.append("-------- NODES --------")
-    for rosname, data in truth.get("nodes", {}).items():
-        parts.append("{!r} {}".format(rosname, data))
-    parts.append("-------- REPORT --------")
-    parts.append(str(report))
+# One JSON object per line, with a "record" field, written as the report is
+# traversed, so that the file can be filtered and loaded line by line:
+#   metrics   one per scope (overall, launch, ..., node, parameter, ...)
+#             and attribute
+#   ged       the GraphEditDistance, at each level of attributes
+#   approximate  one per resource type matched approximately, with its
+#             ApproxBound
+#   truth     one per ground truth entity; links have the ROS name of
+#             their "node"
+#   match     a "haros" entity matched with a "truth" entity
+#   missing   a truth entity without a match
+#   spurious  a HAROS entity without a match
+#   diff      an attribute that differs in a match
+# Entities never include their links, which have records of their own.
+
+DUMP_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+AGGREGATE_SCOPES = ("overall", "launch", "source", "topics", "services",
+                    "params")
+
+def write_jsonl(fname, report, compression=None):
+    # Returns the number of records written.
+    n = 0
+    with _open_dump(fname, compression) as f:
+        for record in _dump_records(report):
+            line = json.dumps(record, separators=(",", ":"), default=repr)
+            f.write(line.encode("utf-8"))
+            f.write(b"\n")
+            n += 1
+    return n
+
+def _open_dump(fname, compression):
+    if compression is None:
+        return io.open(fname, "wb")
+    if compression == "gzip":
+        return gzip.open(fname, "wb")
+    if compression == "zstd":
+        if zstandard is None:
+            raise ImportError("zstd compression requires zstandard")
+        return zstandard.ZstdCompressor().stream_writer(io.open(fname, "wb"))
+    raise ValueError("unknown compression: " + repr(compression))
+
+def _dump_records(report):
+    for scope in AGGREGATE_SCOPES:
+        metrics = getattr(report.aggregate, scope)
+        for attr in sorted(metrics):
+            yield _metrics_record(scope, attr, metrics[attr])
+    for resource in RESOURCE_ATTRS:
+        metrics = getattr(report.resource, resource).metrics
+        for attr in sorted(metrics):
+            yield _metrics_record(resource, attr, metrics[attr])
+    record = {"record": "ged"}
+    record.update(report.ged._asdict())
+    yield record
+    for resource in sorted(report.approximate):
+        record = {"record": "approximate", "resource": resource}
+        record.update(report.approximate[resource]._asdict())
+        yield record
+    M_nodes = report.matching.nodes
+    for v in _truth_entities(M_nodes):
+        yield {"record": "truth", "resource": "node",
+               "entity": _entity_json(v)}
+        for resource, attr in zip(RESOURCE_ATTRS[2:], LINK_ATTRS):
+            for link in getattr(v, attr):
+                yield {"record": "truth", "resource": resource,
+                       "node": v.rosname, "entity": _entity_json(link)}
+    for v in _truth_entities(report.matching.parameters):
+        yield {"record": "truth", "resource": "parameter",
+               "entity": _entity_json(v)}
+    for resource, M in zip(RESOURCE_ATTRS, report.matching):
+        for u, v in M.matches:
+            yield {"record": "match", "resource": resource,
+                   "haros": _entity_json(u), "truth": _entity_json(v)}
+        for v in M.missing:
+            yield {"record": "missing", "resource": resource,
+                   "entity": _entity_json(v)}
+        for u in M.spurious:
+            yield {"record": "spurious", "resource": resource,
+                   "entity": _entity_json(u)}
+    for resource in RESOURCE_ATTRS:
+        for diff in getattr(report.resource, resource).diffs:
+            if diff.attribute != "*": # missing and spurious, see above
+                yield {"record": "diff", "resource": resource,
+                       "rosname": diff.rosname, "attribute": diff.attribute,
+                       "haros": _json_value(diff.p_value),
+                       "truth": _json_value(diff.g_value)}
+
+def _metrics_record(scope, attr, m):
+    record = {"record": "metrics", "scope": scope, "attribute": attr}
+    record.update(zip(m._fields, m))
+    return record
+
+def _truth_entities(M):
+    for _, v in M.matches:
+        yield v
+    for v in M.missing:
+        yield v
+
+def _entity_json(entity):
+    return {name: _json_value(value)
+            for name, value in zip(entity._fields, entity)
+            if name != "key" and name not in LINK_ATTRS}
+
+def _json_value(value):
+    if isinstance(value, ConditionTree):
+        return _condition_paths(value)
+    if hasattr(value, "_asdict"):
+        return {k: _json_value(v) for k, v in value._asdict().items()}
+    if isinstance(value, dict):
+        return {str(k): _json_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_value(v) for v in value]
+    return value
+
+def _condition_paths(cfg):
+    # lists of guards, from the root of the tree to each leaf
+    paths = []
+    stack = [(cfg, [])]
+    while stack:
+        cfg, path = stack.pop()
+        if not cfg:
+            if path:
+                paths.append(path)
+            continue
+        for g, child in reversed(list(cfg.items())):
+            stack.append((child, path + [_json_value(g)]))
+    return paths
+
+def write_summary(fname, summary, reports=None):
+    # cross-configuration summary (see `graph_diff.summarize`), as JSON
+    configs = []
+    for i, name in enumerate(summary.names):
+        entry = {"name": name}
+        entry.update(summary.overall[i]._asdict())
+        if reports is not None:
+            entry["match_time"] = reports[i].match_time
+            entry["report_time"] = reports[i].report_time
+            entry["ged"] = dict(reports[i].ged._asdict())
+        configs.append(entry)
+    total = {scope: getattr(summary.total, scope)["*"]._asdict()
+             for scope in AGGREGATE_SCOPES}
+    with open(fname, "w") as f:
+        json.dump({"configurations": configs, "total": total}, f, indent=2)
+
+def write_trace(fname, tracer):
+    # spans of a `tracing.Tracer`, as Chrome trace events
     with open(fname, "w") as f:
-        f.write("\n".join(parts))
+        json.dump(trace_events(tracer), f, separators=(",", ":"))
 
 def write_latex(fname, report):
     parts = []
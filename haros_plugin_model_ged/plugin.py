@@ -31,7 +31,22 @@ user_data:
     haros_plugin_model_ged:
         import:
             - config_name
-        truth:
+        solver: dense   # dense | sparse | auto | approx
+        time_budget: null  # seconds to improve approx solutions
+        workers: 1      # parallel link matching, if > 1
+        pool: process   # process | thread
+        chunksize: null
+        match_cache: path/to/dir   # reuse matchings from previous runs
+        truth_cache: path/to/dir   # compiled ground truth snapshots
+        truth_file: path/to/truth.yaml  # .yaml | .json | .msgpack
+        diffs: all      # all | sample | none
+        max_diffs: 100  # per resource type and category, if sampled
+        diff_page_size: 1000  # diffs per exported HTML page
+        dump_compression: null  # null | gzip | zstd
+        trace: false    # export phase spans as Chrome trace events
+        log_limit: null # matches logged per resource type, if debugging
+        model_snapshot: false  # export the converted model, for offline use
+        truth:   # inline, if there is no truth_file
             nodes:
                 /full/name:
                     node_type: pkg/type
@@ -83,10 +98,25 @@ user_data:
 
 from builtins import range
 
+from collections import namedtuple
+from multiprocessing import cpu_count, Pool
+import os
 from timeit import default_timer as timer
 
-from .graph_diff import calc_performance
-from .output_format import perf_report_html, write_latex, write_txt
+from .graph_diff import calc_performance, DEFAULT_MAX_DIFFS, summarize
+from .graph_matching import (
+    clear_entity_store, convert_model, convert_truth, LINK_ATTRS, MatchOptions
+)
+from .match_cache import MatchCache
+from .truth_loader import load_truth_file, TRUTH_FILE_ERRORS
+from .truth_snapshot import (
+    save_model_snapshot, truth_digest, TruthSnapshots
+)
+from .output_format import (
+    DIFF_PAGE_SIZE, DUMP_SUFFIXES, ged_report_html, perf_report_html,
+    write_html_diffs, write_jsonl, write_latex, write_summary, write_trace
+)
+from .tracing import span, Tracer, use_tracer
 
 ###############################################################################
 # Plugin Entry Point
@@ -94,52 +124,360 @@ from .output_format import perf_report_html, write_latex, write_txt
 
 def configuration_analysis(iface, config):
     attr = config.user_attributes.get("haros_plugin_model_ged")
-    if attr is None:
+    if not _has_truth(attr):
         return
-    truth = attr.get("truth")
-    if truth is None:
+    error = output_options_error(attr)
+    if error is not None:
+        iface.log_error(error)
         return
-    # ---- SETUP PHASE --------------------------------------------------------
+    tracer = new_tracer(attr)
+    with use_tracer(tracer):
+        # ---- SETUP PHASE ----------------------------------------------------
+        start_time = timer()
+        with span("setup", "phase"):
+            with span("merge truth", "setup") as s:
+                base = merged_base(iface, config, attr)
+                if base is None:
+                    return
+                s.count(nodes=len(base["nodes"]),
+                        parameters=len(base["parameters"]))
+            truth = convert_base(base, attr)
+        end_time = timer()
+        setup_time = end_time - start_time
+        # ---- REPORT PHASE ---------------------------------------------------
+        model = config
+        snapshot = None
+        if attr.get("model_snapshot"):
+            model, snapshot = export_model(config)
+        options = match_options(attr, config.name)
+        report = calc_performance(model, truth, iface, options=options,
+            diffs=attr.get("diffs", "all"),
+            max_diffs=attr.get("max_diffs", DEFAULT_MAX_DIFFS),
+            log_limit=attr.get("log_limit"))
+        if options.cache is not None:
+            options.cache.save()
+        # ---- OUTPUT PHASE ---------------------------------------------------
+        html, files, write_time = write_report_files(config.name, attr,
+            report, setup_time, hard_coded_nodes(base))
+    if snapshot is not None:
+        files.append(snapshot)
+    if tracer is not None:
+        files.append(write_trace_file(config.name, tracer))
+    publish_reports(iface, report, html, files, setup_time, write_time)
+
+
+def export_model(config):
+    # Returns the converted model and the name of its snapshot file,
+    # to evaluate it again offline (see the `offline` module).
+    with span("convert model", "convert") as s:
+        model = convert_model(config)
+        s.count(nodes=len(model.nodes), parameters=len(model.parameters))
+    fname = "model-{}.snapshot".format(config.name)
+    with span("write model snapshot", "output"):
+        save_model_snapshot(fname, model)
+    return model, fname
+
+
+###############################################################################
+# Batch Entry Point
+###############################################################################
+
+# Evaluates many configurations at once, given as (iface, config) pairs.
+# The truth bases of all configurations are merged and converted in this
+# process, once per distinct truth; then every configuration is matched,
+# evaluated and written in a pool of `workers` processes (one per CPU by
+# default). The distinct truths are sent once to each worker, when it
+# starts, and workers only send back what has to go through the iface.
+# Writes the same reports as `configuration_analysis` for each
+# configuration, plus a `perf-summary.json` of all of them, exported with
+# the first iface. Returns the Summary (see `graph_diff.summarize`).
+
+BatchJob = namedtuple("BatchJob", ("iface", "name", "attr", "model",
+    "digest", "setup_time", "hc_nodes"))
+
+# `report` is a PerformanceReport without `resource` and `matching`
+BatchResult = namedtuple("BatchResult",
+    ("report", "html", "files", "write_time"))
+
+# options for `write_report_files` and `new_tracer`
+OUTPUT_OPTIONS = ("diff_page_size", "dump_compression", "trace")
+
+
+def batch_analysis(items, workers=None):
+    jobs = []
+    truths = {} # digest -> TruthData
+    for iface, config in items:
+        attr = config.user_attributes.get("haros_plugin_model_ged")
+        if not _has_truth(attr):
+            continue
+        error = output_options_error(attr)
+        if error is not None:
+            iface.log_error(error)
+            continue
+        start_time = timer()
+        base = merged_base(iface, config, attr)
+        if base is None:
+            continue
+        digest = truth_digest(base)
+        if digest not in truths:
+            truths[digest] = convert_truth(convert_base(base, attr))
+        model = convert_model(config)
+        setup_time = timer() - start_time
+        jobs.append(BatchJob(iface, config.name, attr, model, digest,
+                             setup_time, hard_coded_nodes(base)))
+    if not jobs:
+        return None
+    # workers get no iface, and only the options they use, not the truth
+    keys = ("diffs", "max_diffs") + OUTPUT_OPTIONS
+    tasks = [(job._replace(iface=None,
+                           attr={k: job.attr[k] for k in keys
+                                 if k in job.attr}),
+              match_options(job.attr, job.name).replace(workers=1))
+             for job in jobs]
+    if workers is None:
+        workers = cpu_count()
+    workers = min(workers, len(tasks))
+    if workers <= 1:
+        _init_batch_worker(truths)
+        try:
+            results = [_batch_task(task) for task in tasks]
+        finally:
+            _init_batch_worker({})
+    else:
+        pool = Pool(workers, _init_batch_worker, (truths,))
+        try:
+            results = pool.map(_batch_task, tasks, 1)
+        finally:
+            pool.close()
+            pool.join()
+    for job, result in zip(jobs, results):
+        publish_reports(job.iface, result.report, result.html, result.files,
+                        job.setup_time, result.write_time)
+    reports = [result.report for result in results]
+    summary = summarize([job.name for job in jobs], reports)
+    fname = "perf-summary.json"
+    write_summary(fname, summary, reports)
+    jobs[0].iface.export_file(fname)
+    # a batch converts everything at once, so nothing is left to share
+    clear_entity_store()
+    return summary
+
+
+# digest -> TruthData, in batch workers
+_batch_truths = {}
+
+def _init_batch_worker(truths):
+    global _batch_truths
+    _batch_truths = truths
+
+def _batch_task(task):
+    # the trace of a job only has the spans recorded in its worker
+    job, options = task
+    tracer = new_tracer(job.attr)
+    with use_tracer(tracer):
+        report = calc_performance(job.model, _batch_truths[job.digest], None,
+            options=options, diffs=job.attr.get("diffs", "all"),
+            max_diffs=job.attr.get("max_diffs", DEFAULT_MAX_DIFFS))
+        if options.cache is not None:
+            options.cache.save()
+        html, files, write_time = write_report_files(job.name, job.attr,
+            report, job.setup_time, job.hc_nodes)
+    if tracer is not None:
+        files.append(write_trace_file(job.name, tracer))
+    return BatchResult(report._replace(resource=None, matching=None),
+                       html, files, write_time)
+
+
+###############################################################################
+# Helper Functions
+###############################################################################
+
+def output_options_error(attr):
+    # Returns the error message for invalid output options, or None.
+    # Checked up front, so that no report files are left half written.
+    size = attr.get("diff_page_size", DIFF_PAGE_SIZE)
+    if isinstance(size, bool) or not isinstance(size, int) or size < 1:
+        return "diff_page_size must be a positive integer, not {!r}".format(
+            size)
+    return None
+
+
+def write_report_files(name, attr, report, setup_time, hc_nodes):
+    # Returns the inline HTML report, the names of the files written, and
+    # the time it took to write them.
     start_time = timer()
-    base = new_base()
-    build_base(base, attr.get("import", ()), iface)
-    update_base(base, truth)
-    end_time = timer()
-    setup_time = end_time - start_time
-    # ---- REPORT PHASE -------------------------------------------------------
-    report = calc_performance(config, base, iface)
-    hc_nodes = len([n for n in base.get("nodes", {}).values()
-                    if not (n.get("publishers") or n.get("subscribers")
-                            or n.get("clients") or n.get("servers")
-                            or n.get("setters") or n.get("getters"))])
+    with span("output", "phase"):
+        with span("write html diffs", "output") as s:
+            files = write_html_diffs("diffs-{}".format(name), report,
+                page_size=attr.get("diff_page_size", DIFF_PAGE_SIZE))
+            s.count(diffs=sum(len(r.diffs) for r in report.resource),
+                    pages=len(files))
+        with span("write html report", "output"):
+            html = perf_report_html(report, setup_time, hc_nodes, files,
+                                    diff_mode=attr.get("diffs", "all"))
+        with span("write latex", "output"):
+            fname = "perf-metrics-{}.tex".format(name)
+            write_latex(fname, report)
+            files.append(fname)
+        with span("write jsonl", "output") as s:
+            compression = attr.get("dump_compression")
+            fname = "dump-{}.jsonl{}".format(name, DUMP_SUFFIXES[compression])
+            s.count(records=write_jsonl(fname, report,
+                                        compression=compression))
+            files.append(fname)
+    return html, files, timer() - start_time
+
+
+def publish_reports(iface, report, html, files, setup_time, write_time):
     iface.report_metric("precision", report.aggregate.overall["*"].pre)
     iface.report_metric("recall", report.aggregate.overall["*"].rec)
     iface.report_metric("f1", report.aggregate.overall["*"].f1)
-    iface.report_runtime_violation("reportPerformance",
-        perf_report_html(report, setup_time, hc_nodes))
-    fname = "perf-metrics-{}.tex".format(config.name)
-    write_latex(fname, report)
-    iface.export_file(fname)
-    fname = "dump-{}.txt".format(config.name)
-    write_txt(fname, base, report)
-    iface.export_file(fname)
+    iface.report_metric("simpleGED", report.ged.simple)
+    iface.report_metric("midGED", report.ged.mid)
+    iface.report_metric("fullGED", report.ged.full)
+    iface.report_metric("setupTime", setup_time)
+    iface.report_metric("matchTime", report.match_time)
+    iface.report_metric("reportTime", report.report_time)
+    iface.report_metric("writeTime", write_time)
+    iface.report_runtime_violation("reportGED", ged_report_html(report))
+    iface.report_runtime_violation("reportPerformance", html)
+    for fname in files:
+        iface.export_file(fname)
 
 
-###############################################################################
-# Helper Functions
-###############################################################################
+def new_tracer(attr):
+    # None if tracing is disabled
+    if attr.get("trace"):
+        return Tracer()
+    return None
+
+
+def write_trace_file(name, tracer):
+    fname = "trace-{}.json".format(name)
+    write_trace(fname, tracer)
+    return fname
+
+
+def hard_coded_nodes(base):
+    # nodes without any links
+    return len([n for n in base.get("nodes", {}).values()
+                if not _has_links(n)])
+
+
+def merged_base(iface, config, attr):
+    # Returns None, after logging the error, if the truth cannot be loaded.
+    base = new_base()
+    try:
+        build_base(base, attr.get("import", ()), iface, path=(config.name,))
+        truth = load_truth(attr)
+    except (ImportCycleError,) + TRUTH_FILE_ERRORS as e:
+        iface.log_error(str(e))
+        return None
+    update_base(base, truth)
+    return base
+
+
+def match_options(attr, name):
+    cache = None
+    cache_dir = attr.get("match_cache")
+    if cache_dir is not None:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        fname = "match-cache-{}.json".format(name)
+        cache = MatchCache.load(os.path.join(cache_dir, fname))
+    return MatchOptions(
+        solver=attr.get("solver", "dense"),
+        workers=attr.get("workers", 1),
+        pool=attr.get("pool", "process"),
+        chunksize=attr.get("chunksize"),
+        cache=cache,
+        time_budget=attr.get("time_budget"))
+
+
+def _has_truth(attr):
+    return attr is not None and (attr.get("truth") is not None
+                                 or attr.get("truth_file") is not None)
+
+
+def load_truth(attr):
+    truth = attr.get("truth")
+    if truth is None and attr.get("truth_file") is not None:
+        truth = load_truth_file(attr["truth_file"])
+    return truth or {}
+
+
+def convert_base(base, attr):
+    cache_dir = attr.get("truth_cache")
+    if cache_dir is None:
+        return base # converted later, on demand
+    with span("truth snapshot", "setup"):
+        return TruthSnapshots(cache_dir).convert(base)
+
 
 def new_base():
     return {"nodes": {}, "parameters": {}}
 
 
-def build_base(base, config_names, iface):
-    for config_name in config_names:
-        config = iface.find_configuration(config_name)
-        attr = config.user_attributes["haros_plugin_model_ged"]
-        build_base(base, attr.get("import", ()), iface)
-        update_base(base, attr["truth"])
+class ImportCycleError(ValueError):
+    def __init__(self, cycle):
+        ValueError.__init__(self, "ground truth import cycle: {}".format(
+            " -> ".join(cycle)))
+        self.cycle = cycle
+
+
+# Imports form a DAG. Every configuration is merged after all of its imports,
+# in depth-first order, and exactly once, even if imported several times.
+# The merged base of each configuration is cached for the whole HAROS run.
+
+ResolvedImport = namedtuple("ResolvedImport",
+    ("attr", "base", "order"))
+
+# config name -> ResolvedImport
+_resolved_imports = {}
+
+
+def build_base(base, config_names, iface, path=()):
+    # `path` holds the configurations being resolved, to detect cycles.
+    # Returns the names of the configurations merged into `base`, in order.
+    order = []
+    merged = set()
+    for name in config_names:
+        resolved = _resolve_import(name, iface, path)
+        if not order:
+            update_base(base, resolved.base)
+            order.extend(resolved.order)
+            merged.update(resolved.order)
+            continue
+        for other in resolved.order:
+            if other not in merged:
+                merged.add(other)
+                order.append(other)
+                attr = _resolve_import(other, iface, path).attr
+                update_base(base, load_truth(attr))
+    return order
+
+def _resolve_import(name, iface, path):
+    if name in path:
+        raise ImportCycleError(path[path.index(name):] + (name,))
+    config = iface.find_configuration(name)
+    attr = config.user_attributes["haros_plugin_model_ged"]
+    resolved = _resolved_imports.get(name)
+    if resolved is None or resolved.attr is not attr:
+        base = new_base()
+        order = build_base(base, attr.get("import", ()), iface,
+                           path=path + (name,))
+        update_base(base, load_truth(attr))
+        order.append(name)
+        resolved = ResolvedImport(attr, base, tuple(order))
+        _resolved_imports[name] = resolved
+    return resolved
 
 def update_base(base, truth):
     base["nodes"].update(truth.get("nodes", {}))
     base["parameters"].update(truth.get("parameters", {}))
+
+def _has_links(node):
+    # raw truth data, or a converted node from a truth file
+    if isinstance(node, dict):
+        return any(node.get(attr) for attr in LINK_ATTRS)
+    return any(getattr(node, attr) for attr in LINK_ATTRS)
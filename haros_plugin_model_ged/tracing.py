@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+#Copyright (c) 2020 André Santos
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in
+#all copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#THE SOFTWARE.
+
+
+
+###############################################################################
+# Imports
+###############################################################################
+
+from builtins import object
+from collections import namedtuple
+from contextlib import contextmanager
+import os
+from threading import current_thread
+from timeit import default_timer as timer
+
+
+###############################################################################
+# Spans
+###############################################################################
+
+# Spans are timed sections of the plugin, with the numbers of elements they
+# processed in `counts` (a dict). Spans are recorded by the active tracer,
+# which is switched with `use_tracer`, like the debug logger of
+# `graph_matching`. The default tracer records nothing.
+
+# `start` and `duration` in seconds, `start` relative to the tracer origin
+SpanRecord = namedtuple("SpanRecord",
+    ("name", "category", "start", "duration", "counts", "thread"))
+
+
+class Tracer(object):
+    __slots__ = ("spans", "origin", "pid")
+
+    def __init__(self):
+        self.spans = []
+        self.origin = timer()
+        self.pid = os.getpid()
+
+    def span(self, name, category, **counts):
+        return Span(self, name, category, counts)
+
+    def totals(self):
+        # {span name: total duration}
+        totals = {}
+        for record in self.spans:
+            totals[record.name] = (totals.get(record.name, 0.0)
+                                   + record.duration)
+        return totals
+
+
+class Span(object):
+    __slots__ = ("tracer", "name", "category", "counts", "start")
+
+    def __init__(self, tracer, name, category, counts):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.counts = counts
+        self.start = None
+
+    def count(self, **counts):
+        # element counts that are only known within the span
+        self.counts.update(counts)
+
+    def __enter__(self):
+        self.start = timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = timer()
+        tracer = self.tracer
+        tracer.spans.append(SpanRecord(self.name, self.category,
+            self.start - tracer.origin, end - self.start, self.counts,
+            current_thread().ident))
+        return False
+
+
+class NullTracer(object):
+    __slots__ = ()
+
+    def span(self, name, category, **counts):
+        return NULL_SPAN
+
+
+class NullSpan(object):
+    __slots__ = ()
+
+    def count(self, **counts):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_TRACER = NullTracer()
+
+NULL_SPAN = NullSpan()
+
+_tracer = NULL_TRACER
+
+
+def span(name, category, **counts):
+    return _tracer.span(name, category, **counts)
+
+def active_tracer():
+    return _tracer
+
+@contextmanager
+def use_tracer(tracer):
+    # `tracer` is active within the block; None keeps the active tracer
+    global _tracer
+    if tracer is None:
+        yield _tracer
+        return
+    previous = _tracer
+    _tracer = tracer
+    try:
+        yield tracer
+    finally:
+        _tracer = previous
+
+
+###############################################################################
+# Trace Events
+###############################################################################
+
+def trace_events(tracer):
+    # Chrome trace event format (complete events), in microseconds.
+    # Nested spans are shown nested by `chrome://tracing` and Perfetto.
+    events = []
+    for record in tracer.spans:
+        events.append({
+            "name": record.name,
+            "cat": record.category,
+            "ph": "X",
+            "ts": record.start * 1e6,
+            "dur": record.duration * 1e6,
+            "pid": tracer.pid,
+            "tid": record.thread,
+            "args": record.counts,
+        })
+    events.sort(key=lambda e: (e["ts"], -e["dur"]))
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
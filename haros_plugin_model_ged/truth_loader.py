@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+
+#Copyright (c) 2020 André Santos
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in
+#all copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#THE SOFTWARE.
+
+
+
+###############################################################################
+# Notes
+###############################################################################
+
+# External ground truth files.
+# Instead of an inline `truth`, a configuration may point to a file with
+#   truth_file: path/to/truth.yaml
+# holding the same `nodes` and `parameters` mappings, in YAML (the default),
+# JSON (`.json`) or MessagePack (`.msgpack`, `.mpk`, requires `msgpack`).
+#
+# YAML and MessagePack files are read as a stream of events, and each entry
+# (a node or a parameter) is converted as soon as it is complete, so that
+# the raw document tree is never held in memory as a whole.
+# The standard `json` module can only parse whole documents, but the raw
+# entries are still dropped as soon as they are converted.
+#
+# The result maps ROS names to converted entries, so it can be merged with
+# other truth bases (see `plugin.update_base`). Loaded files are cached by
+# modification time and content hash for the whole HAROS run.
+
+
+###############################################################################
+# Imports
+###############################################################################
+
+from builtins import range
+from collections import namedtuple
+from itertools import count
+import hashlib
+import io
+import json
+import os
+
+from yaml import YAMLError
+from yaml.events import (
+    AliasEvent, MappingEndEvent, MappingStartEvent, ScalarEvent,
+    SequenceEndEvent, SequenceStartEvent, StreamEndEvent
+)
+from yaml.nodes import ScalarNode
+
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+try:
+    import msgpack
+    from msgpack.exceptions import UnpackException
+except ImportError:
+    msgpack = None
+    UnpackException = None
+
+from .graph_matching import (
+    convert_truth_node, convert_truth_params, LINK_ATTRS
+)
+
+
+###############################################################################
+# Truth File Cache
+###############################################################################
+
+SECTIONS = ("nodes", "parameters")
+
+CachedTruth = namedtuple("CachedTruth", ("mtime", "size", "digest", "truth"))
+
+# absolute path -> CachedTruth
+_truth_files = {}
+
+# malformed files, besides EnvironmentError for unreadable ones
+PARSE_ERRORS = (ValueError, YAMLError)
+if UnpackException is not None:
+    PARSE_ERRORS += (UnpackException,)
+
+# everything `load_truth_file` raises for a bad file
+TRUTH_FILE_ERRORS = (EnvironmentError,) + PARSE_ERRORS
+
+
+class TruthFileError(ValueError):
+    def __init__(self, path, error):
+        ValueError.__init__(self, "invalid ground truth file '{}': {}"
+                            .format(path, error))
+        self.path = path
+        self.error = error
+
+
+def load_truth_file(path):
+    # Returns {"nodes": {rosname: NodeAttrs},
+    #          "parameters": {rosname: (ParamAttrs, ...)}}
+    # Raises EnvironmentError if the file cannot be read, and TruthFileError
+    # if it is malformed.
+    path = os.path.abspath(os.path.expanduser(path))
+    st = os.stat(path)
+    cached = _truth_files.get(path)
+    if cached is not None:
+        if cached.mtime == st.st_mtime and cached.size == st.st_size:
+            return cached.truth
+        digest = file_digest(path)
+        if cached.digest == digest:
+            _truth_files[path] = cached._replace(mtime=st.st_mtime,
+                                                 size=st.st_size)
+            return cached.truth
+    else:
+        digest = file_digest(path)
+    try:
+        truth = convert_entries(read_entries(path))
+    except PARSE_ERRORS as e:
+        raise TruthFileError(path, e)
+    _truth_files[path] = CachedTruth(st.st_mtime, st.st_size, digest, truth)
+    return truth
+
+
+def file_digest(path, block_size=1 << 20):
+    h = hashlib.sha1()
+    with io.open(path, "rb") as f:
+        block = f.read(block_size)
+        while block:
+            h.update(block)
+            block = f.read(block_size)
+    return h.hexdigest()
+
+
+###############################################################################
+# Conversion
+###############################################################################
+
+# Converted truth entities use the `id` of their raw data as key, but raw
+# entries are discarded right away, and their ids are reused. Entities from
+# truth files are given unique keys of their own.
+_keys = count()
+
+
+def convert_entries(entries):
+    truth = {"nodes": {}, "parameters": {}}
+    nodes = truth["nodes"]
+    params = truth["parameters"]
+    for section, rosname, data in entries:
+        try:
+            if section == "nodes":
+                nodes[rosname] = _rekey(convert_truth_node(rosname, data))
+            else:
+                params[rosname] = tuple(_rekey(param)
+                    for param in convert_truth_params(rosname, data))
+        except (AttributeError, KeyError, TypeError) as e:
+            raise ValueError("malformed {} entry {!r}: {!r}".format(
+                section[:-1], rosname, e))
+    return truth
+
+def _rekey(entity):
+    links = {attr: [_rekey(link) for link in getattr(entity, attr)]
+             for attr in LINK_ATTRS if hasattr(entity, attr)}
+    return entity._replace(key=next(_keys), **links)
+
+
+###############################################################################
+# File Readers
+###############################################################################
+
+def read_entries(path):
+    # Yields (section, rosname, raw data) for every entry in the file.
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".json":
+        return _json_entries(path)
+    if ext in (".msgpack", ".mpk"):
+        return _msgpack_entries(path)
+    return _yaml_entries(path)
+
+
+def _json_entries(path):
+    with io.open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError("the ground truth must be a mapping")
+    for section in SECTIONS:
+        entries = data.pop(section, None) or {}
+        if not isinstance(entries, dict):
+            raise ValueError("'{}' must be a mapping".format(section))
+        for rosname in list(entries):
+            yield section, rosname, entries.pop(rosname)
+
+
+def _msgpack_entries(path):
+    if msgpack is None:
+        # reported as a bad truth file, like any other file it cannot read
+        raise ValueError("MessagePack files require msgpack "
+                         "(pip install haros_plugin_model_ged[msgpack])")
+    with io.open(path, "rb") as f:
+        unpacker = msgpack.Unpacker(f, raw=False)
+        for _ in range(unpacker.read_map_header()):
+            section = unpacker.unpack()
+            if section not in SECTIONS:
+                unpacker.skip()
+                continue
+            for _ in range(unpacker.read_map_header()):
+                rosname = unpacker.unpack()
+                yield section, rosname, unpacker.unpack()
+
+
+def _yaml_entries(path):
+    with io.open(path, "rb") as f:
+        loader = YamlLoader(f)
+        try:
+            for entry in _yaml_events(loader):
+                yield entry
+        finally:
+            loader.dispose()
+
+def _yaml_events(loader):
+    loader.get_event() # StreamStartEvent
+    if loader.check_event(StreamEndEvent):
+        return # empty file
+    loader.get_event() # DocumentStartEvent
+    if not loader.check_event(MappingStartEvent):
+        raise ValueError("the ground truth must be a mapping")
+    loader.get_event()
+    anchors = {}
+    while not loader.check_event(MappingEndEvent):
+        section = _yaml_value(loader, anchors)
+        if section not in SECTIONS:
+            _yaml_value(loader, anchors)
+        elif loader.check_event(MappingStartEvent):
+            loader.get_event()
+            while not loader.check_event(MappingEndEvent):
+                rosname = _yaml_value(loader, anchors)
+                yield section, rosname, _yaml_value(loader, anchors)
+            loader.get_event()
+        elif _yaml_value(loader, anchors): # null or empty section is fine
+            raise ValueError("'{}' must be a mapping".format(section))
+
+def _yaml_value(loader, anchors):
+    # Builds the next value in the stream, without composing YAML nodes.
+    event = loader.get_event()
+    if isinstance(event, AliasEvent):
+        if event.anchor not in anchors:
+            raise ValueError("undefined alias: {}".format(event.anchor))
+        return anchors[event.anchor]
+    if isinstance(event, ScalarEvent):
+        value = _yaml_scalar(loader, event)
+    elif isinstance(event, SequenceStartEvent):
+        value = []
+        if event.anchor is not None:
+            anchors[event.anchor] = value
+        while not loader.check_event(SequenceEndEvent):
+            value.append(_yaml_value(loader, anchors))
+        loader.get_event()
+    elif isinstance(event, MappingStartEvent):
+        value = {}
+        if event.anchor is not None:
+            anchors[event.anchor] = value
+        merged = []
+        while not loader.check_event(MappingEndEvent):
+            key = _yaml_value(loader, anchors)
+            if key is MERGE_KEY:
+                other = _yaml_value(loader, anchors)
+                merged.extend(other if isinstance(other, list) else (other,))
+            else:
+                value[key] = _yaml_value(loader, anchors)
+        loader.get_event()
+        for other in merged:
+            for key, item in other.items():
+                value.setdefault(key, item)
+    else:
+        raise ValueError("unexpected YAML event: {}".format(event))
+    if event.anchor is not None:
+        anchors[event.anchor] = value
+    return value
+
+# `<<` keys merge other mappings into the current one
+MERGE_KEY = object()
+
+MERGE_TAG = "tag:yaml.org,2002:merge"
+
+def _yaml_scalar(loader, event):
+    tag = event.tag
+    if tag is None or tag == "!":
+        tag = loader.resolve(ScalarNode, event.value, event.implicit)
+    if tag == MERGE_TAG:
+        return MERGE_KEY
+    node = ScalarNode(tag, event.value, event.start_mark, event.end_mark,
+                      event.style)
+    constructor = loader.yaml_constructors.get(tag)
+    if constructor is None:
+        constructor = loader.yaml_constructors[None]
+    return constructor(loader, node)
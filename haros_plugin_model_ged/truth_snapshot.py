@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+
+#Copyright (c) 2020 André Santos
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in
+#all copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#THE SOFTWARE.
+
+
+###############################################################################
+# Notes
+###############################################################################
+
+# Compiled ground truth snapshots.
+# A snapshot holds the converted ground truth (see `convert_truth`) of a
+# merged truth base, and is keyed by a digest of that base, which includes
+# every imported configuration. Changing any of them changes the digest.
+#
+# File format:
+#   MAGIC (8 bytes) | digest (40 bytes, ASCII hex) | marshal payload
+# The header is checked first, and only then is the payload read and
+# decoded with `marshal`, which is only a fraction of the cost of converting
+# the truth again.
+# The payload only holds built-in types (tuples, dicts, strings, numbers),
+# since `marshal` does not support named tuples.
+#
+# A directory keeps the MAX_SNAPSHOTS most recently used snapshots; older
+# ones are deleted whenever a new snapshot is saved.
+#
+# Model snapshots hold a converted HAROS configuration (see `convert_model`),
+# to evaluate it again without HAROS, in the same format, with MODEL_MAGIC
+# and the digest of the payload, which starts with the FORMAT it was
+# written with.
+
+
+###############################################################################
+# Imports
+###############################################################################
+
+from builtins import object, zip
+import gc
+import hashlib
+import io
+import marshal
+import os
+import sys
+
+from .graph_matching import (
+    convert_truth, EMPTY_CONDITIONS, GetAttrs, LINK_ATTRS, ModelData,
+    new_condition_tree, new_guard, new_location, NodeAttrs, ParamAttrs,
+    PubAttrs, SetAttrs, SrvAttrs, SubAttrs, TruthData
+)
+
+
+###############################################################################
+# Snapshot Cache
+###############################################################################
+
+MAGIC = b"HGEDTRU1"
+
+DIGEST_SIZE = 40
+
+# marshal data is only guaranteed to be compatible within a Python version
+FORMAT = "{}:{}.{}".format(MAGIC.decode("ascii"), *sys.version_info[:2])
+
+MAX_SNAPSHOTS = 32
+
+
+class TruthSnapshots(object):
+    __slots__ = ("directory", "max_snapshots")
+
+    def __init__(self, directory, max_snapshots=MAX_SNAPSHOTS):
+        self.directory = directory
+        self.max_snapshots = max_snapshots
+
+    def convert(self, base):
+        # Returns the converted `base`, from its snapshot, if there is one.
+        # Otherwise, converts `base` and saves a new snapshot.
+        digest = truth_digest(base)
+        path = os.path.join(self.directory, "truth-{}.snapshot".format(digest))
+        truth = load_snapshot(path, digest)
+        if truth is None:
+            truth = convert_truth(base)
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            if save_snapshot(path, digest, truth):
+                self.prune()
+        else:
+            _touch(path)
+        return truth
+
+    def prune(self):
+        # Deletes all but the `max_snapshots` most recently used snapshots.
+        snapshots = []
+        for name in os.listdir(self.directory):
+            if name.startswith("truth-") and name.endswith(".snapshot"):
+                path = os.path.join(self.directory, name)
+                try:
+                    snapshots.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass # deleted by another process
+        snapshots.sort(reverse=True)
+        for _, path in snapshots[self.max_snapshots:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def _touch(path):
+    # the modification time of a snapshot is the last time it was used
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+def truth_digest(base):
+    h = hashlib.sha1(FORMAT.encode("ascii"))
+    data = _digest_base(base)
+    try:
+        # version 2 has no object references, so equal data (in the same
+        # order, as loaded from the same files) gives equal bytes
+        h.update(marshal.dumps(data, 2))
+    except ValueError:
+        h.update(repr(data).encode("utf-8"))
+    return h.hexdigest()
+
+def _digest_base(base):
+    # entries from truth files are converted already, with arbitrary keys
+    return {section: {rosname: _digest_entry(data)
+                      for rosname, data in entries.items()}
+            for section, entries in base.items()}
+
+def _digest_entry(data):
+    if isinstance(data, ENTITY_TYPES):
+        return _encode_entity(data, keys=False)
+    if isinstance(data, tuple):
+        return tuple(_encode_entity(param, keys=False) for param in data)
+    return data
+
+
+def save_snapshot(path, digest, truth):
+    try:
+        payload = marshal.dumps((
+            tuple(_encode_entity(node) for node in truth.nodes),
+            tuple(_encode_entity(param) for param in truth.parameters)))
+    except ValueError:
+        return False  # the truth holds values that marshal does not support
+    tmp = path + ".tmp"
+    with io.open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(digest.encode("ascii"))
+        f.write(payload)
+    os.rename(tmp, path)
+    return True
+
+
+def load_snapshot(path, digest):
+    # Returns None if the file does not exist or is not for `digest`.
+    # Decoding creates lots of containers, which would trigger the cyclic
+    # garbage collector over and over, but none of them is part of a cycle.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _load_snapshot(path, digest)
+    finally:
+        if enabled:
+            gc.enable()
+
+def _load_snapshot(path, digest):
+    header = len(MAGIC) + DIGEST_SIZE
+    try:
+        f = io.open(path, "rb")
+    except IOError:
+        return None
+    with f:
+        if f.read(header) != MAGIC + digest.encode("ascii"):
+            return None
+        payload = f.read()
+    try:
+        nodes, params = marshal.loads(payload)
+    except (EOFError, TypeError, ValueError):
+        return None # truncated or corrupted
+    return TruthData([_decode_entity(node) for node in nodes],
+                     [_decode_entity(param) for param in params])
+
+
+###############################################################################
+# Model Snapshots
+###############################################################################
+
+MODEL_MAGIC = b"HGEDMOD1"
+
+
+def save_model_snapshot(path, model):
+    # Raises ValueError if the model holds values that marshal does not
+    # support.
+    payload = marshal.dumps((FORMAT,
+        tuple(_encode_entity(node) for node in model.nodes),
+        tuple(_encode_entity(param) for param in model.parameters)))
+    digest = hashlib.sha1(payload).hexdigest()
+    tmp = path + ".tmp"
+    with io.open(tmp, "wb") as f:
+        f.write(MODEL_MAGIC)
+        f.write(digest.encode("ascii"))
+        f.write(payload)
+    os.rename(tmp, path)
+
+
+def load_model_snapshot(path):
+    # Raises ValueError if the file is not a valid model snapshot for this
+    # version of Python.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _load_model_snapshot(path)
+    finally:
+        if enabled:
+            gc.enable()
+
+def _load_model_snapshot(path):
+    with io.open(path, "rb") as f:
+        magic = f.read(len(MODEL_MAGIC))
+        expected = f.read(DIGEST_SIZE)
+        payload = f.read()
+    if magic != MODEL_MAGIC or not payload:
+        raise ValueError("not a model snapshot: " + path)
+    if expected != hashlib.sha1(payload).hexdigest().encode("ascii"):
+        raise ValueError("corrupted model snapshot: " + path)
+    try:
+        data = marshal.loads(payload)
+    except (EOFError, TypeError, ValueError):
+        data = None
+    if not isinstance(data, tuple) or data[0] != FORMAT:
+        raise ValueError("model snapshot from another Python version: "
+                         + path)
+    _, nodes, params = data
+    return ModelData([_decode_entity(node) for node in nodes],
+                     [_decode_entity(param) for param in params])
+
+
+###############################################################################
+# Encoding
+###############################################################################
+
+ENTITY_TYPES = (NodeAttrs, ParamAttrs, PubAttrs, SubAttrs, SrvAttrs,
+                SetAttrs)
+
+assert SrvAttrs is not SubAttrs and GetAttrs is SetAttrs
+
+
+# type -> (traceability index, conditions index, link indices)
+_LAYOUT = tuple(
+    (cls._fields.index("traceability"), cls._fields.index("conditions"),
+     tuple(i for i, name in enumerate(cls._fields) if name in LINK_ATTRS))
+    for cls in ENTITY_TYPES)
+
+
+def _encode_entity(entity, keys=True):
+    i_loc, i_cfg, i_links = _LAYOUT[ENTITY_TYPES.index(type(entity))]
+    values = list(entity)
+    if not keys:
+        values[0] = None
+    values[i_loc] = tuple(values[i_loc])
+    values[i_cfg] = _encode_conditions(values[i_cfg])
+    for i in i_links:
+        values[i] = tuple(_encode_entity(link, keys=keys)
+                          for link in values[i])
+    return (ENTITY_TYPES.index(type(entity)), tuple(values))
+
+def _decode_entity(data):
+    t, values = data
+    i_loc, i_cfg, i_links = _LAYOUT[t]
+    values = list(values)
+    values[i_loc] = new_location(*values[i_loc])
+    values[i_cfg] = _decode_conditions(values[i_cfg])
+    for i in i_links:
+        values[i] = [_decode_entity(link) for link in values[i]]
+    return tuple.__new__(ENTITY_TYPES[t], values)
+
+def _encode_conditions(cfg):
+    return {tuple(g): _encode_conditions(child) for g, child in cfg.items()}
+
+def _decode_conditions(cfg):
+    if not cfg:
+        return EMPTY_CONDITIONS
+    return new_condition_tree({new_guard(*g): _decode_conditions(child)
+                               for g, child in cfg.items()})
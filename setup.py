@@ -43,9 +43,12 @@ setup(
     packages = find_packages(),
     package_data = {"haros_plugin_model_ged": ["plugin.yaml"]},
     install_requires = [
-        "networkx>=2.2.0,<3.0.0",
         "numpy>=1.15.4",
-        "scipy>=1.1.0"
+        "scipy>=1.1.0",
+        "PyYAML"
     ],
+    extras_require = {
+        "msgpack": ["msgpack>=0.6.0"]
+    },
     zip_safe = False
 )